@@ -4,89 +4,452 @@ Receives PDF petitions, extracts text, and classifies them using OpenAI API.
 """
 
 import os
+import asyncio
+import logging
+import gzip
+import hashlib
 import tempfile
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, Request, HTTPException, Query
-from fastapi.responses import HTMLResponse, JSONResponse, Response
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple, Dict, Any, List, Callable, Awaitable, TYPE_CHECKING
+from fastapi import FastAPI, APIRouter, File, UploadFile, Request, HTTPException, Query
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
+import orjson
 
 from utils.pdf_extractor import PDFExtractor
-from utils.openai_classifier import ICETEXClassifier
 from utils.knowledge_base import ICETEXKnowledgeBase
-from utils.excel_search import ExcelSearch
-from utils.pdf_generator import PDFGenerator
+from utils.classification_cache import ClassificationCache
+from utils.logging_config import setup_logging
+
+# openai, pandas and reportlab are only imported when first needed
+if TYPE_CHECKING:
+    from utils.openai_classifier import ICETEXClassifier
+    from utils.excel_search import ExcelSearch
+    from utils.pdf_generator import PDFGenerator
 
 # Load environment variables
 load_dotenv()
 
+# Configuration read once at startup (used by the request handlers)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_KEY_PRESENT = bool(os.getenv("OPENAI_API_KEY", "").strip())
+# Default is 'data/contratos_icetex.xlsx' in project root
+EXCEL_FILE_PATH = os.getenv("EXCEL_FILE_PATH")
+# Set ENABLE_EXCEL_SEARCH=false to deploy only the classifier (no /search page or /api/* routes)
+ENABLE_EXCEL_SEARCH = os.getenv("ENABLE_EXCEL_SEARCH", "true").lower() == "true"
+
+# Log through a background queue listener so handlers never block on stdout
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="ICETEX Petition Classifier",
     description="AI system for classifying ICETEX petitions to appropriate dependencies",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Excel search routes, registered at the end of the module when ENABLE_EXCEL_SEARCH is on
+excel_router = APIRouter()
+
+# Compress larger JSON/HTML responses for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+STATIC_DIR = "static"
+STATIC_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+class VersionedStaticFiles(StaticFiles):
+    """Static files; URLs carrying a ?v= content version are cached by browsers/CDNs for a year."""
+    
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if "v" in parse_qs(scope.get("query_string", b"").decode("latin-1")):
+            response.headers["Cache-Control"] = STATIC_IMMUTABLE_CACHE
+        return response
+
+
+@lru_cache(maxsize=None)
+def static_url(path: str) -> str:
+    """
+    Return the URL of a static asset with a content hash for cache busting.
+    
+    Args:
+        path: Path relative to the static directory (e.g. 'images/icetex.png')
+    """
+    path = path.lstrip("/")
+    try:
+        with open(os.path.join(STATIC_DIR, path), 'rb') as f:
+            version = hashlib.sha256(f.read()).hexdigest()[:12]
+    except OSError:
+        return f"/static/{path}"
+    return f"/static/{path}?v={version}"
+
+
 # Setup templates
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_url
+
+# Pages render without per-request context, so their HTML is rendered once and reused;
+# set TEMPLATE_RELOAD=true while editing templates to re-render when a file changes
+TEMPLATE_RELOAD = os.getenv("TEMPLATE_RELOAD", "false").lower() == "true"
+_rendered_pages: Dict[str, Tuple[float, bytes]] = {}
+
+
+def render_page(name: str) -> HTMLResponse:
+    """Return the cached rendering of a parameter-free template."""
+    cached = _rendered_pages.get(name)
+    mtime = os.path.getmtime(os.path.join("templates", name)) if TEMPLATE_RELOAD else 0.0
+    if cached is None or cached[0] != mtime:
+        html = templates.get_template(name).render().encode('utf-8')
+        cached = _rendered_pages[name] = (mtime, html)
+    return HTMLResponse(content=cached[1])
 
 # Mount static files directory for images, CSS, JS, etc.
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", VersionedStaticFiles(directory=STATIC_DIR, check_dir=False, html=False), name="static")
 
-# Initialize extractors, classifiers, and knowledge base
+# Initialize extractors, classifiers, and knowledge base (sharing one extractor)
 pdf_extractor = PDFExtractor()
-knowledge_base = ICETEXKnowledgeBase()
+knowledge_base = ICETEXKnowledgeBase(pdf_extractor=pdf_extractor)
 openai_classifier = None  # Will be initialized when API key is available
 excel_search = None  # Will be initialized when needed
+_excel_failed_mtime = None  # Modification time of a changed Excel file that failed to load
 
+# Cache of previous classifications (exact text hash + embedding similarity)
+classification_cache = ClassificationCache(
+    cache_path=os.getenv("CLASSIFICATION_CACHE_PATH", "knowledge_base/classification_cache.pkl"),
+    similarity_threshold=float(os.getenv("CLASSIFICATION_CACHE_SIMILARITY", "0.93"))
+)
 
-def get_classifier() -> ICETEXClassifier:
+# ICETEX dependencies that can be assigned (static, so the JSON body is encoded once)
+ICETEX_DEPENDENCIES = [
+    {
+        "name": "Oficina Asesora Jurídica",
+        "description": "Legal interpretation, contracts, administrative law, litigation, disciplinary processes"
+    },
+    {
+        "name": "Oficina Asesora de Planeación",
+        "description": "Strategic planning, institutional performance, indicators, process optimization"
+    },
+    {
+        "name": "Oficina Asesora de Comunicaciones",
+        "description": "Institutional communications, public relations, press releases, brand reputation"
+    },
+    {
+        "name": "Oficina de Riesgos",
+        "description": "Risk management, operational risk, compliance with internal control systems"
+    },
+    {
+        "name": "Oficina de Control Interno",
+        "description": "Audits, internal oversight, compliance, anti-corruption plans"
+    },
+    {
+        "name": "Oficina de Relaciones Internacionales",
+        "description": "International scholarships, cooperation programs, partnerships abroad"
+    },
+    {
+        "name": "Oficina Comercial y de Mercadeo",
+        "description": "Promotion of products, user acquisition, advertising, customer service"
+    },
+    {
+        "name": "Vicepresidencia de Crédito y Cobranza",
+        "description": "Credit granting, collection, loan management, payment agreements"
+    },
+    {
+        "name": "Vicepresidencia de Operaciones y Tecnología",
+        "description": "Systems management, IT infrastructure, platform maintenance"
+    },
+    {
+        "name": "Vicepresidencia Financiera",
+        "description": "Treasury, accounting, financial management, budget control"
+    },
+    {
+        "name": "Vicepresidencia de Fondos en Administración",
+        "description": "Management of special education funds, forgiveness (condonación) processes, verification of fund regulations"
+    },
+    {
+        "name": "Secretaría General",
+        "description": "Contractual management, records, administrative coordination, HR, disciplinary support"
+    }
+]
+
+_DEPENDENCIES_BODY = orjson.dumps({"dependencies": ICETEX_DEPENDENCIES})
+_DEPENDENCIES_ETAG = f'"{hashlib.sha256(_DEPENDENCIES_BODY).hexdigest()[:32]}"'
+_DEPENDENCIES_HEADERS = {
+    "Cache-Control": "public, max-age=3600",
+    "ETag": _DEPENDENCIES_ETAG,
+    "Vary": "Accept-Encoding"
+}
+# Compressed once at startup; responses that set Content-Encoding bypass GZipMiddleware
+_DEPENDENCIES_GZIP_BODY = gzip.compress(_DEPENDENCIES_BODY, compresslevel=9)
+_DEPENDENCIES_GZIP_HEADERS = {**_DEPENDENCIES_HEADERS, "Content-Encoding": "gzip"}
+
+
+def _build_health_body() -> bytes:
+    """Encode the health check response (configuration is fixed for the process lifetime)."""
+    api_key = os.getenv("OPENAI_API_KEY", "").strip()
+    
+    return orjson.dumps({
+        "status": "healthy",
+        "openai_configured": OPENAI_KEY_PRESENT,
+        "model": OPENAI_MODEL,
+        "debug": {
+            "api_key_exists": OPENAI_KEY_PRESENT,
+            "api_key_length": len(api_key) if OPENAI_KEY_PRESENT else 0,
+            "api_key_prefix": api_key[:10] + "..." if OPENAI_KEY_PRESENT else "None"
+        }
+    })
+
+
+_HEALTH_BODY = _build_health_body()
+
+
+# Serialize lazy initialization so concurrent first requests build each singleton once
+_classifier_lock = asyncio.Lock()
+_excel_search_lock = asyncio.Lock()
+
+
+async def get_classifier() -> "ICETEXClassifier":
     """Get or initialize the OpenAI classifier."""
     global openai_classifier
-    if openai_classifier is None:
+    classifier = openai_classifier
+    if classifier is not None:
+        return classifier
+    
+    # Checked up front so a missing key never goes through the constructor's ValueError
+    if not OPENAI_KEY_PRESENT:
+        raise HTTPException(
+            status_code=500,
+            detail="OpenAI API key not configured. Please set OPENAI_API_KEY in .env file."
+        )
+    
+    async with _classifier_lock:
+        if openai_classifier is None:
+            from utils.openai_classifier import ICETEXClassifier
+            openai_classifier = await asyncio.to_thread(ICETEXClassifier, knowledge_base=knowledge_base)
+        return openai_classifier
+
+
+# Blocking work (PDF extraction, OpenAI calls) runs in a bounded thread pool
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", min(8, os.cpu_count() or 1)))
+
+# Uploads are streamed in chunks; anything over the spool size spills to disk
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_SPOOL_SIZE = 2 * 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "25")) * 1024 * 1024
+
+# Maximum number of PDFs accepted by /classify-batch (keeps the prompt within the context window)
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10"))
+
+# Every PDF starts with this header (readers tolerate it within the first KiB)
+PDF_MAGIC = b"%PDF-"
+PDF_MAGIC_WINDOW = 1024
+PDF_SUFFIX = ".pdf"
+
+
+def has_pdf_suffix(filename: Optional[str]) -> bool:
+    """Return True if the uploaded filename ends in .pdf (case-insensitive)."""
+    return bool(filename) and filename[-4:].lower() == PDF_SUFFIX
+
+
+async def spool_upload(file: UploadFile) -> Tuple[tempfile.SpooledTemporaryFile, int, str]:
+    """
+    Stream an uploaded PDF into a spooled temporary file.
+    
+    Small files stay in memory; larger ones are written to disk so memory
+    use is bounded by the chunk size rather than the file size. The first
+    chunk must carry the PDF header, so renamed non-PDF files are rejected
+    before any extraction work.
+    
+    Returns:
+        Tuple of (spooled file positioned at the start, size in bytes, SHA-256 hex digest)
+        
+    Raises:
+        HTTPException: 400 if the content is not a PDF, 413 if it exceeds MAX_UPLOAD_SIZE
+    """
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"The uploaded file exceeds the maximum size of {MAX_UPLOAD_SIZE // (1024 * 1024)} MB."
+    )
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise too_large
+    
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            if size == 0 and PDF_MAGIC not in chunk[:PDF_MAGIC_WINDOW]:
+                raise HTTPException(
+                    status_code=400,
+                    detail="The uploaded file is not a valid PDF document."
+                )
+            size += len(chunk)
+            if size > MAX_UPLOAD_SIZE:
+                raise too_large
+            digest.update(chunk)
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    
+    spool.seek(0)
+    return spool, size, digest.hexdigest()
+
+
+# Classifications currently running, keyed by upload content hash
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+async def run_singleflight(key: str, work: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run work() once per key at a time; concurrent callers with the same key await the same result.
+    
+    Args:
+        key: Identifier of the work (e.g. content hash of the upload)
+        work: Coroutine factory producing the result
+        
+    Returns:
+        Result of work(), shared by every concurrent caller
+    """
+    while (future := _inflight.get(key)) is not None:
         try:
-            # Debug: Check environment variable
-            api_key = os.getenv("OPENAI_API_KEY")
-            print(f"🔍 DEBUG: OPENAI_API_KEY exists: {bool(api_key)}")
-            if api_key:
-                print(f"🔍 DEBUG: API key length: {len(api_key)}")
-                print(f"🔍 DEBUG: API key starts with: {api_key[:10]}...")
-            
-            openai_classifier = ICETEXClassifier(knowledge_base=knowledge_base)
-        except ValueError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"OpenAI API key not configured. Please set OPENAI_API_KEY in .env file. Error: {str(e)}"
-            )
-    return openai_classifier
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Propagate our own cancellation; if only the leading request was
+            # cancelled, run the work again (the first waiter to get here leads)
+            if asyncio.current_task().cancelling() or not future.cancelled():
+                raise
+    
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await work()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved when nobody else was waiting
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del _inflight[key]
+
 
+def reset_classifier():
+    """Drop the classifier and cached classifications after the knowledge base changes."""
+    global openai_classifier
+    openai_classifier = None
+    classification_cache.clear()
 
-def get_excel_search() -> ExcelSearch:
-    """Get or initialize the Excel search utility."""
+
+@lru_cache(maxsize=None)
+def get_pdf_generator() -> "PDFGenerator":
+    """Get the shared PDF generator (its paragraph styles are built once)."""
+    from utils.pdf_generator import PDFGenerator
+    return PDFGenerator()
+
+
+async def reload_excel_search(current: "ExcelSearch"):
+    """
+    Load the changed Excel file into a new search utility and swap it in once loaded.
+    
+    Searches running meanwhile keep using the current instance; if the file cannot be
+    loaded (e.g. it is still being written), the current data keeps being served.
+    """
+    global excel_search, _excel_failed_mtime
+    try:
+        mtime = os.path.getmtime(current.excel_file_path)
+    except OSError:
+        return
+    if mtime == _excel_failed_mtime:
+        return
+    
+    logger.info("Excel file changed on disk, reloading...")
+    try:
+        from utils.excel_search import ExcelSearch
+        excel_search = await asyncio.to_thread(ExcelSearch, EXCEL_FILE_PATH)
+    except Exception as e:
+        # Not retried until the file changes again
+        _excel_failed_mtime = mtime
+        logger.warning("Could not reload Excel file, serving the previous data: %s", e)
+
+
+async def get_excel_search() -> "ExcelSearch":
+    """Get or initialize the Excel search utility (reloaded when the file changes on disk)."""
     global excel_search
-    if excel_search is None:
-        try:
-            # You can specify the path to your Excel file via environment variable
-            # Default is 'data/contratos_icetex.xlsx' in project root
-            excel_path = os.getenv("EXCEL_FILE_PATH", None)
-            excel_search = ExcelSearch(excel_path)
-            print(f"✅ Excel search utility initialized")
-        except FileNotFoundError as e:
-            print(f"⚠️ Warning: Excel file not found: {e}")
-            # Extract user-friendly message from the exception
-            error_msg = str(e) if "Excel file not found" in str(e) else "Excel file not found."
-            raise HTTPException(
-                status_code=404,
-                detail=f"{error_msg}"
-            )
-        except Exception as e:
-            print(f"⚠️ Warning: Could not initialize Excel search: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error initializing Excel search: {str(e)}"
-            )
-    return excel_search
+    search_util = excel_search
+    if search_util is not None and not search_util.is_modified():
+        return search_util
+    
+    async with _excel_search_lock:
+        if excel_search is not None:
+            if excel_search.is_modified():
+                await reload_excel_search(excel_search)
+        else:
+            try:
+                # You can specify the path to your Excel file via the EXCEL_FILE_PATH environment variable
+                from utils.excel_search import ExcelSearch
+                excel_search = await asyncio.to_thread(ExcelSearch, EXCEL_FILE_PATH)
+                logger.info("Excel search utility initialized")
+            except FileNotFoundError as e:
+                logger.warning("Excel file not found: %s", e)
+                # Extract user-friendly message from the exception
+                error_msg = str(e) if "Excel file not found" in str(e) else "Excel file not found."
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"{error_msg}"
+                )
+            except Exception as e:
+                logger.warning("Could not initialize Excel search: %s", e)
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error initializing Excel search: {str(e)}"
+                )
+        return excel_search
+
+
+@app.on_event("startup")
+async def configure_worker_pool():
+    """Bound the thread pool used for blocking work (PDF extraction, OpenAI calls)."""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="icetex-worker")
+    )
+
+
+@app.on_event("startup")
+async def warm_up():
+    """
+    Initialize the classifier and load the Excel index before the first request.
+    
+    Missing optional components (API key, Excel file) are logged and left to
+    be initialized lazily, so the app still starts.
+    """
+    components = {"OpenAI classifier": get_classifier()}
+    if ENABLE_EXCEL_SEARCH:
+        components["Excel search"] = get_excel_search()
+    
+    results = await asyncio.gather(*components.values(), return_exceptions=True)
+    for component, result in zip(components, results):
+        if isinstance(result, Exception):
+            reason = result.detail if isinstance(result, HTTPException) else str(result)
+            logger.warning("%s not warmed up at startup: %s", component, reason)
+
+
+@app.on_event("shutdown")
+async def save_classification_cache():
+    """Persist cached classifications so they survive restarts."""
+    classification_cache.save()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -94,7 +457,7 @@ async def upload_form(request: Request):
     """
     Display the upload form for PDF petitions.
     """
-    return templates.TemplateResponse("upload.html", {"request": request})
+    return render_page("upload.html")
 
 
 @app.get("/admin", response_class=HTMLResponse)
@@ -102,19 +465,149 @@ async def admin_panel(request: Request):
     """
     Display the admin panel for managing the knowledge base.
     """
-    return templates.TemplateResponse("admin.html", {"request": request})
+    return render_page("admin.html")
 
 
-@app.get("/search", response_class=HTMLResponse)
+@excel_router.get("/search", response_class=HTMLResponse)
 async def search_page(request: Request):
     """
     Display the search page for searching by name or ID.
     """
-    return templates.TemplateResponse("search.html", {"request": request})
+    return render_page("search.html")
+
+
+def insufficient_text_response(extracted_text: str) -> ORJSONResponse:
+    """Error response for a PDF that yielded too little text to classify."""
+    return ORJSONResponse(
+        status_code=400,
+        content={
+            "error": "Could not extract sufficient text from the PDF",
+            "detail": "The PDF might be corrupted, password-protected, or contain no readable text. Please ensure the document is a valid PDF with text content.",
+            "extracted_text": extracted_text[:500] if extracted_text else ""
+        }
+    )
+
+
+async def find_cached_classification(classifier: "ICETEXClassifier", extracted_text: str):
+    """
+    Look up a previous classification of the same (or a near-identical) petition.
+    
+    Returns:
+        Tuple of (cache key, cached classification or None, cache hit type or None, embedding)
+    """
+    cache_key = classification_cache.make_key(extracted_text, classifier.cache_namespace)
+    cached = classification_cache.get_exact(cache_key)
+    if cached is not None:
+        return cache_key, cached, "exact", None
+    
+    embedding = await asyncio.to_thread(classifier.embed, extracted_text)
+    cached = classification_cache.get_similar(embedding)
+    return cache_key, cached, "similar" if cached is not None else None, embedding
+
+
+def start_classifier_init() -> "asyncio.Task":
+    """
+    Start getting the classifier in the background, so its (first-time) setup overlaps other work.
+    
+    Failures are re-raised by awaiting the task; a task nobody awaits is left to
+    finish, so the next request finds the classifier ready.
+    """
+    task = asyncio.create_task(get_classifier())
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+async def extract_with_classifier(pdf_stream):
+    """
+    Extract a spooled petition PDF while the classifier is initialized concurrently.
+    
+    Returns:
+        Tuple of (extracted text, task resolving to the classifier)
+    """
+    classifier_task = start_classifier_init()
+    extracted_text = await asyncio.to_thread(pdf_extractor.extract_from_stream, pdf_stream)
+    return extracted_text, classifier_task
+
+
+async def process_petition(pdf_stream) -> Any:
+    """
+    Extract and classify a spooled petition PDF.
+    
+    Returns:
+        Classification dict with metadata, or an error response if no text could be extracted
+    """
+    # Extract text from PDF (the classifier is initialized meanwhile)
+    extracted_text, classifier_task = await extract_with_classifier(pdf_stream)
+    
+    if not extracted_text or len(extracted_text.strip()) < 10:
+        return insufficient_text_response(extracted_text)
+    
+    logger.info("Extracted %d characters from PDF", len(extracted_text))
+    
+    classifier = await classifier_task
+    cache_key, cached, cache_hit, embedding = await find_cached_classification(classifier, extracted_text)
+    
+    # Classify using OpenAI (awaited on the event loop, no worker thread held)
+    classification_result = await classifier.aclassify_with_metadata(extracted_text, classification=cached)
+    classification_result["metadata"]["cache"] = cache_hit
+    
+    if cached is None and classification_result["classification"].get("dependencia") != "Error":
+        classification_cache.put(cache_key, classification_result["classification"], embedding)
+    
+    return classification_result
+
+
+async def stream_petition(pdf_stream, filename: str) -> Response:
+    """
+    Extract a spooled petition PDF and stream its classification as NDJSON.
+    
+    Extraction happens before the response starts, so the upload can be closed
+    by the caller; only the OpenAI call is streamed. The last line is always
+    {"type": "result", ...} with the same fields as the non-streaming response.
+    """
+    extracted_text, classifier_task = await extract_with_classifier(pdf_stream)
+    
+    if not extracted_text or len(extracted_text.strip()) < 10:
+        return insufficient_text_response(extracted_text)
+    
+    logger.info("Extracted %d characters from PDF (streaming)", len(extracted_text))
+    
+    classifier = await classifier_task
+    cache_key, cached, cache_hit, embedding = await find_cached_classification(classifier, extracted_text)
+    
+    def result_line(classification: Dict[str, Any], cache: Optional[str]) -> bytes:
+        result = classifier.classify_with_metadata(extracted_text, classification=classification)
+        result["metadata"]["cache"] = cache
+        return orjson.dumps({"type": "result", **result, "filename": filename}) + b"\n"
+    
+    async def events():
+        if cached is not None:
+            yield result_line(cached, cache_hit)
+            return
+        
+        async for event in classifier.classify_stream(extracted_text):
+            if event["type"] != "result":
+                yield orjson.dumps(event) + b"\n"
+                continue
+            
+            classification = event["classification"]
+            if classification.get("dependencia") != "Error":
+                classification_cache.put(cache_key, classification, embedding)
+            yield result_line(classification, None)
+    
+    # "identity" keeps GZipMiddleware from buffering the events until enough output accumulates
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": "identity"}
+    )
 
 
 @app.post("/classify")
-async def classify_petition(file: UploadFile = File(...)):
+async def classify_petition(
+    file: UploadFile = File(...),
+    stream: bool = Query(False, description="Stream the classification as NDJSON events")
+):
     """
     Classify an uploaded PDF petition.
     
@@ -130,56 +623,166 @@ async def classify_petition(file: UploadFile = File(...)):
         - confianza: Confidence level (percentage)
         - motivo: Explanation for the classification
         - palabras_clave: Keywords detected in the text
+        
+        With stream=true the response is NDJSON instead: "delta" events with the
+        model output as it is generated, a "dependencia" event as soon as that
+        field is known, and a final "result" event with the fields above.
     """
     
     # Validate file type
-    if not file.filename.lower().endswith('.pdf'):
+    if not has_pdf_suffix(file.filename):
         raise HTTPException(
             status_code=400,
             detail="Only PDF files are accepted. Please upload a PDF document."
         )
     
+    spool = None
     try:
-        # Read file contents
-        file_contents = await file.read()
+        # Stream file contents to a spooled temporary file
+        spool, file_size, content_hash = await spool_upload(file)
         
-        if len(file_contents) == 0:
+        if file_size == 0:
             raise HTTPException(
                 status_code=400,
                 detail="The uploaded file is empty."
             )
         
-        # Extract text from PDF
-        print(f"Processing file: {file.filename} ({len(file_contents)} bytes)")
-        extracted_text = pdf_extractor.extract_from_bytes(file_contents)
+        logger.info("Processing file: %s (%d bytes)", file.filename, file_size)
+        if stream:
+            return await stream_petition(spool, file.filename)
         
-        if not extracted_text or len(extracted_text.strip()) < 10:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": "Could not extract sufficient text from the PDF",
-                    "detail": "The PDF might be corrupted, password-protected, or contain no readable text. Please ensure the document is a valid PDF with text content.",
-                    "extracted_text": extracted_text[:500] if extracted_text else ""
-                }
-            )
-        
-        print(f"Extracted {len(extracted_text)} characters from PDF")
+        # Identical uploads being processed concurrently share one extraction + classification
+        classification_result = await run_singleflight(
+            content_hash, lambda: process_petition(spool)
+        )
         
-        # Classify using OpenAI
-        classifier = get_classifier()
-        classification_result = classifier.classify_with_metadata(extracted_text)
+        if isinstance(classification_result, Response):
+            return classification_result
         
         # Add filename to response
-        classification_result["filename"] = file.filename
-        
-        return JSONResponse(content=classification_result)
+        return {**classification_result, "filename": file.filename}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error processing file: {str(e)}")
+        logger.exception("Error processing file: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error processing petition: {str(e)}"
         )
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+@app.post("/classify-batch")
+async def classify_petition_batch(files: List[UploadFile] = File(...)):
+    """
+    Classify several uploaded PDF petitions with a single OpenAI request.
+    
+    All PDFs are extracted in parallel, exact repeats are answered from the
+    classification cache, and the remaining petitions share one chat completion.
+    
+    Returns:
+        JSON response with one entry per file, in upload order: the same
+        classification/metadata/filename fields as /classify, or filename + error
+    """
+    if len(files) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. A batch can contain at most {MAX_BATCH_SIZE} PDFs."
+        )
+    
+    spools = []
+    try:
+        # Stream every upload; invalid files are reported per item
+        items = []
+        for file in files:
+            item = {"filename": file.filename}
+            items.append(item)
+            if not has_pdf_suffix(file.filename):
+                item["error"] = "Only PDF files are accepted. Please upload a PDF document."
+                continue
+            try:
+                spool, file_size, _ = await spool_upload(file)
+            except HTTPException as e:
+                item["error"] = e.detail
+                continue
+            spools.append(spool)
+            if file_size == 0:
+                item["error"] = "The uploaded file is empty."
+            else:
+                item["stream"] = spool
+        
+        # Extract text from all PDFs in parallel (the classifier is initialized meanwhile)
+        classifier_task = start_classifier_init()
+        to_extract = [item for item in items if "stream" in item]
+        texts = await asyncio.gather(*[
+            asyncio.to_thread(pdf_extractor.extract_from_stream, item.pop("stream"))
+            for item in to_extract
+        ])
+        for item, text in zip(to_extract, texts):
+            if not text or len(text.strip()) < 10:
+                item["error"] = "Could not extract sufficient text from the PDF"
+            else:
+                item["text"] = text
+        
+        # Reuse cached classifications, then classify the rest in one request
+        classifier = await classifier_task
+        to_classify = []
+        for item in items:
+            if "text" not in item:
+                continue
+            item["cache_key"] = classification_cache.make_key(item["text"], classifier.cache_namespace)
+            cached = classification_cache.get_exact(item["cache_key"])
+            if cached is not None:
+                item["classification"], item["cache"] = cached, "exact"
+            else:
+                to_classify.append(item)
+        
+        if to_classify:
+            classifications = await asyncio.to_thread(
+                classifier.classify_many, [item["text"] for item in to_classify]
+            )
+            
+            # Petitions the shared request could not answer are retried individually, concurrently
+            failed = [i for i, classification in enumerate(classifications) if classification.get("dependencia") == "Error"]
+            if failed and len(to_classify) > 1:
+                retried = await classifier.aclassify_many([to_classify[i]["text"] for i in failed])
+                for i, classification in zip(failed, retried):
+                    classifications[i] = classification
+            
+            for item, classification in zip(to_classify, classifications):
+                item["classification"], item["cache"] = classification, None
+                if classification.get("dependencia") != "Error":
+                    classification_cache.put(item["cache_key"], classification)
+        
+        results = []
+        for item in items:
+            if "error" in item:
+                results.append({"filename": item["filename"], "error": item["error"]})
+                continue
+            result = classifier.classify_with_metadata(item["text"], classification=item["classification"])
+            result["metadata"]["cache"] = item["cache"]
+            result["filename"] = item["filename"]
+            results.append(result)
+        
+        return {
+            "results": results,
+            "count": len(results)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error processing batch: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing petitions: {str(e)}"
+        )
+    finally:
+        for spool in spools:
+            spool.close()
 
 
 @app.get("/result", response_class=HTMLResponse)
@@ -187,7 +790,7 @@ async def result_page(request: Request):
     """
     Display the results page (used after classification).
     """
-    return templates.TemplateResponse("result.html", {"request": request})
+    return render_page("result.html")
 
 
 @app.get("/health")
@@ -195,78 +798,29 @@ async def health_check():
     """
     Health check endpoint.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    api_key_configured = api_key is not None
-    
-    return {
-        "status": "healthy",
-        "openai_configured": api_key_configured,
-        "model": os.getenv("OPENAI_MODEL", "gpt-4-turbo"),
-        "debug": {
-            "api_key_exists": bool(api_key),
-            "api_key_length": len(api_key) if api_key else 0,
-            "api_key_prefix": api_key[:10] + "..." if api_key else "None"
-        }
-    }
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 @app.get("/dependencies")
-async def list_dependencies():
+async def list_dependencies(request: Request):
     """
     Return the list of ICETEX dependencies that can be assigned.
     """
-    dependencies = [
-        {
-            "name": "Oficina Asesora Jurídica",
-            "description": "Legal interpretation, contracts, administrative law, litigation, disciplinary processes"
-        },
-        {
-            "name": "Oficina Asesora de Planeación",
-            "description": "Strategic planning, institutional performance, indicators, process optimization"
-        },
-        {
-            "name": "Oficina Asesora de Comunicaciones",
-            "description": "Institutional communications, public relations, press releases, brand reputation"
-        },
-        {
-            "name": "Oficina de Riesgos",
-            "description": "Risk management, operational risk, compliance with internal control systems"
-        },
-        {
-            "name": "Oficina de Control Interno",
-            "description": "Audits, internal oversight, compliance, anti-corruption plans"
-        },
-        {
-            "name": "Oficina de Relaciones Internacionales",
-            "description": "International scholarships, cooperation programs, partnerships abroad"
-        },
-        {
-            "name": "Oficina Comercial y de Mercadeo",
-            "description": "Promotion of products, user acquisition, advertising, customer service"
-        },
-        {
-            "name": "Vicepresidencia de Crédito y Cobranza",
-            "description": "Credit granting, collection, loan management, payment agreements"
-        },
-        {
-            "name": "Vicepresidencia de Operaciones y Tecnología",
-            "description": "Systems management, IT infrastructure, platform maintenance"
-        },
-        {
-            "name": "Vicepresidencia Financiera",
-            "description": "Treasury, accounting, financial management, budget control"
-        },
-        {
-            "name": "Vicepresidencia de Fondos en Administración",
-            "description": "Management of special education funds, forgiveness (condonación) processes, verification of fund regulations"
-        },
-        {
-            "name": "Secretaría General",
-            "description": "Contractual management, records, administrative coordination, HR, disciplinary support"
-        }
-    ]
+    if request.headers.get("if-none-match") == _DEPENDENCIES_ETAG:
+        return Response(status_code=304, headers=_DEPENDENCIES_HEADERS)
+    
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            content=_DEPENDENCIES_GZIP_BODY,
+            media_type="application/json",
+            headers=_DEPENDENCIES_GZIP_HEADERS
+        )
     
-    return {"dependencies": dependencies}
+    return Response(
+        content=_DEPENDENCIES_BODY,
+        media_type="application/json",
+        headers=_DEPENDENCIES_HEADERS
+    )
 
 
 @app.post("/upload-dependencies")
@@ -285,53 +839,59 @@ async def upload_dependencies_document(file: UploadFile = File(...)):
         JSON response with upload results
     """
     # Validate file type
-    if not file.filename.lower().endswith('.pdf'):
+    if not has_pdf_suffix(file.filename):
         raise HTTPException(
             status_code=400,
             detail="Only PDF files are accepted for dependencies document."
         )
     
+    spool = None
     try:
-        # Read file contents
-        file_contents = await file.read()
+        # Stream file contents to a spooled temporary file
+        spool, file_size, _ = await spool_upload(file)
         
-        if len(file_contents) == 0:
+        if file_size == 0:
             raise HTTPException(
                 status_code=400,
                 detail="The uploaded file is empty."
             )
         
         # Upload to knowledge base
-        result = knowledge_base.upload_dependencies_from_bytes(
-            file_contents, 
+        result = await asyncio.to_thread(
+            knowledge_base.upload_dependencies_from_stream,
+            spool, 
             file.filename,
             "Official ICETEX Dependencies Document"
         )
         
         if result["success"]:
             # Reset classifier to use new knowledge base
-            global openai_classifier
-            openai_classifier = None
+            reset_classifier()
             
-            return JSONResponse(content={
+            return {
                 "success": True,
                 "message": result["message"],
                 "filename": result.get("filename"),
                 "text_length": result.get("text_length"),
                 "knowledge_base_info": knowledge_base.get_knowledge_base_info()
-            })
+            }
         else:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to process dependencies document: {result['error']}"
             )
             
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error uploading dependencies document: {str(e)}")
+        logger.exception("Error uploading dependencies document: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error uploading dependencies document: {str(e)}"
         )
+    finally:
+        if spool is not None:
+            spool.close()
 
 
 @app.get("/knowledge-base")
@@ -344,7 +904,7 @@ async def get_knowledge_base_info():
     """
     try:
         info = knowledge_base.get_knowledge_base_info()
-        return JSONResponse(content=info)
+        return info
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -365,10 +925,9 @@ async def clear_knowledge_base():
         
         if result["success"]:
             # Reset classifier
-            global openai_classifier
-            openai_classifier = None
+            reset_classifier()
             
-            return JSONResponse(content=result)
+            return result
         else:
             raise HTTPException(
                 status_code=500,
@@ -382,7 +941,7 @@ async def clear_knowledge_base():
         )
 
 
-@app.get("/api/search")
+@excel_router.get("/api/search")
 async def api_search(q: str = Query(..., description="Search term (name or ID)")):
     """
     Search for records by name or ID in the Excel file.
@@ -400,7 +959,7 @@ async def api_search(q: str = Query(..., description="Search term (name or ID)")
         )
     
     try:
-        search_util = get_excel_search()
+        search_util = await get_excel_search()
         results = search_util.search_by_name_or_id(q.strip())
         
         return {
@@ -424,7 +983,7 @@ async def api_search(q: str = Query(..., description="Search term (name or ID)")
         )
 
 
-@app.get("/api/suggestions")
+@excel_router.get("/api/suggestions")
 async def get_suggestions(q: str = Query(..., description="Partial search term (minimum 2 characters)"), limit: int = Query(10, description="Maximum number of suggestions")):
     """
     Get autocomplete suggestions based on partial search term.
@@ -443,7 +1002,7 @@ async def get_suggestions(q: str = Query(..., description="Partial search term (
         }
     
     try:
-        search_util = get_excel_search()
+        search_util = await get_excel_search()
         suggestions = search_util.get_suggestions(q.strip(), limit=limit)
         
         return {
@@ -468,7 +1027,7 @@ async def get_suggestions(q: str = Query(..., description="Partial search term (
         }
 
 
-@app.get("/api/excel-info")
+@excel_router.get("/api/excel-info")
 async def get_excel_info():
     """
     Get information about the loaded Excel file.
@@ -477,7 +1036,7 @@ async def get_excel_info():
         JSON response with file information
     """
     try:
-        search_util = get_excel_search()
+        search_util = await get_excel_search()
         info = search_util.get_info()
         return info
     except HTTPException:
@@ -489,7 +1048,7 @@ async def get_excel_info():
         )
 
 
-@app.get("/api/download-pdf")
+@excel_router.get("/api/download-pdf")
 async def download_pdf(q: str = Query(..., description="Search term (name or ID)")):
     """
     Generate and download a PDF with search results.
@@ -508,7 +1067,7 @@ async def download_pdf(q: str = Query(..., description="Search term (name or ID)
     
     try:
         # Get search results
-        search_util = get_excel_search()
+        search_util = await get_excel_search()
         results = search_util.search_by_name_or_id(q.strip())
         
         if not results:
@@ -518,8 +1077,7 @@ async def download_pdf(q: str = Query(..., description="Search term (name or ID)
             )
         
         # Generate PDF
-        pdf_generator = PDFGenerator()
-        pdf_buffer = pdf_generator.generate_result_pdf(results, q.strip())
+        pdf_buffer = get_pdf_generator().generate_result_pdf(results, q.strip())
         
         # Generate filename
         filename = f"icetex_contratista_{q.strip().replace(' ', '_')[:50]}.pdf"
@@ -547,6 +1105,10 @@ async def download_pdf(q: str = Query(..., description="Search term (name or ID)
         )
 
 
+if ENABLE_EXCEL_SEARCH:
+    app.include_router(excel_router)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
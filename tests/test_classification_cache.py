@@ -0,0 +1,57 @@
+"""
+Tests for utils.classification_cache.
+"""
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from utils.classification_cache import ClassificationCache
+
+
+RESULT = {"dependencia": "Tesorería", "confianza": "90%", "motivo": "", "palabras_clave": []}
+
+
+def test_exact_key_depends_on_text_and_namespace():
+    """Keys change with the text and with the classifier namespace (model and prompt)."""
+    key = ClassificationCache.make_key("texto", "gpt-4o-mini|abc")
+    assert key == ClassificationCache.make_key("texto", "gpt-4o-mini|abc")
+    assert key != ClassificationCache.make_key("texto ", "gpt-4o-mini|abc")
+    assert key != ClassificationCache.make_key("texto", "gpt-4o|abc")
+
+
+def test_similar_hit_respects_threshold():
+    """Near-duplicates above the cosine threshold hit; dissimilar or other-dimension vectors miss."""
+    cache = ClassificationCache(similarity_threshold=0.9)
+    cache.put("a", RESULT, embedding=[1.0, 0.0, 0.0])
+    
+    assert cache.get_similar([0.99, 0.05, 0.0]) is RESULT
+    assert cache.get_similar([0.0, 1.0, 0.0]) is None
+    assert cache.get_similar([1.0, 0.0]) is None
+    assert cache.get_similar(None) is None
+
+
+def test_eviction_drops_least_recently_used_and_its_embedding():
+    """Entries over max_entries are evicted LRU-first, embeddings included."""
+    cache = ClassificationCache(max_entries=2)
+    cache.put("a", RESULT, embedding=[1.0, 0.0])
+    cache.put("b", RESULT, embedding=[0.0, 1.0])
+    assert cache.get_exact("a") is RESULT  # "b" is now least recently used
+    cache.put("c", RESULT)
+    
+    assert len(cache) == 2
+    assert cache.get_exact("b") is None
+    assert cache.get_similar([0.0, 1.0]) is None
+    assert cache.get_similar([1.0, 0.0]) is RESULT
+
+
+def test_save_and_load_round_trip(tmp_path):
+    """A persisted cache serves the same exact and near-duplicate hits after a restart."""
+    path = tmp_path / "cache.pkl"
+    cache = ClassificationCache(cache_path=str(path))
+    cache.put("a", RESULT, embedding=[1.0, 0.0])
+    cache.save()
+    
+    restored = ClassificationCache(cache_path=str(path))
+    assert restored.get_exact("a") == RESULT
+    assert restored.get_similar([1.0, 0.01]) == RESULT
@@ -0,0 +1,71 @@
+"""
+Regression tests for utils.excel_search.
+"""
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from utils.excel_search import ExcelSearch
+
+
+@pytest.fixture
+def search(tmp_path):
+    """ExcelSearch over a small contracts sheet (CSV, so no Excel reader is needed)."""
+    path = tmp_path / "contratos.csv"
+    path.write_text(
+        "NOMBRE COMPLETO,NUMERO DE IDENTIFICACION\n"
+        "ANA GOMEZ,1234\n"
+        "MARIANA LOPEZ,99123456\n"
+        "PEDRO RUIZ,5678\n",
+        encoding="utf-8"
+    )
+    return ExcelSearch(str(path))
+
+
+def _names(results):
+    return [result["NOMBRE COMPLETO"] for result in results]
+
+
+def test_whole_word_match_keeps_substring_matches(search):
+    """A row with the standalone token must not hide rows containing it as a substring."""
+    assert _names(search.search_by_name_or_id("ana")) == ["ANA GOMEZ", "MARIANA LOPEZ"]
+
+
+def test_exact_id_match_keeps_substring_matches(search):
+    """An exact ID hit must not hide other rows whose ID contains the term."""
+    assert _names(search.search_by_name_or_id("1234")) == ["ANA GOMEZ", "MARIANA LOPEZ"]
+
+
+def test_default_search_matches_explicit_columns(search):
+    """The default fast path returns the same rows as a scan over explicit columns."""
+    for term in ("ana", "1234", "ruiz", "lopez 9", "zzz"):
+        default = search.search_by_name_or_id(term)
+        explicit = search.search_by_name_or_id(
+            term,
+            name_columns=["NOMBRE COMPLETO"],
+            id_columns=["NUMERO DE IDENTIFICACION"]
+        )
+        assert default == explicit
+
+
+def test_calamine_line_breaks_match_openpyxl():
+    """Headers and text cells keep '\\n' line breaks, as the openpyxl reader returns them."""
+    from utils.excel_search import _convert_calamine_cell
+
+    assert _convert_calamine_cell('No. \r\nCto') == 'No. \nCto'
+    assert _convert_calamine_cell('6.20\r\n13.90') == '6.20\n13.90'
+    assert _convert_calamine_cell(1234.0) == 1234
+
+
+def test_cache_from_older_format_is_ignored(search):
+    """A cached frame without the current cache version is rebuilt, not reused."""
+    import pickle
+
+    search.cache_path = search.excel_file_path.with_suffix('.pkl')
+    with open(search.cache_path, 'wb') as f:
+        pickle.dump({"source": search._source_signature(), "df": search.df.iloc[:0]}, f)
+    assert search._read_cached_frame() is None
+
+    search._write_cached_frame()
+    assert len(search._read_cached_frame()) == len(search.df)
@@ -0,0 +1,39 @@
+"""
+Tests for utils.knowledge_base.
+"""
+
+import pytest
+
+pytest.importorskip("orjson")
+
+from utils.knowledge_base import ICETEXKnowledgeBase
+
+
+REFERENCE = "Dependencia de Tesorería: atiende devoluciones y pagos. " * 20
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    kb = ICETEXKnowledgeBase(storage_dir=str(tmp_path / "kb"))
+    kb._save_knowledge_base(REFERENCE)
+    return kb
+
+
+def test_clear_leaves_current_mapping_readable(knowledge_base):
+    """A reader that picked up the mapping before a clear can still slice it."""
+    in_use = knowledge_base._reference_map
+    assert knowledge_base.get_reference_context(100)
+    
+    result = knowledge_base.clear_knowledge_base()
+    
+    assert result["success"]
+    assert in_use[:11] == REFERENCE[:11].encode()
+    assert knowledge_base.get_reference_context(100) == ""
+    assert not knowledge_base.is_available()
+
+
+def test_context_cache_follows_new_reference_text(knowledge_base):
+    """Replacing the reference text never serves the previous document's context."""
+    assert knowledge_base.get_reference_context(50).startswith("Dependencia de Tesorería")
+    knowledge_base._save_knowledge_base("Dependencia de Crédito: estudia solicitudes. " * 20)
+    assert knowledge_base.get_reference_context(50).startswith("Dependencia de Crédito")
@@ -0,0 +1,207 @@
+"""
+Tests for the request helpers in main.py.
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import main
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+
+
+CSV = "NOMBRE COMPLETO,NUMERO DE IDENTIFICACION\nANA GOMEZ,1234\n"
+
+
+@pytest.fixture
+def excel_file(tmp_path, monkeypatch):
+    """Contracts sheet used as main's Excel file, with the module singleton reset."""
+    path = tmp_path / "contratos.csv"
+    path.write_text(CSV, encoding="utf-8")
+    monkeypatch.setattr(main, "EXCEL_FILE_PATH", str(path))
+    monkeypatch.setattr(main, "excel_search", None)
+    monkeypatch.setattr(main, "_excel_failed_mtime", None)
+    return path
+
+
+def _touch(path, text):
+    """Rewrite path with a modification time guaranteed to differ from the current one."""
+    mtime = os.path.getmtime(path)
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime + 10, mtime + 10))
+
+
+def test_excel_reload_swaps_in_a_new_instance(excel_file):
+    """A changed workbook is loaded into a new instance; the old one is left untouched."""
+    async def run():
+        first = await main.get_excel_search()
+        _touch(excel_file, CSV + "PEDRO RUIZ,5678\n")
+        second = await main.get_excel_search()
+        return first, second
+    
+    first, second = asyncio.run(run())
+    assert second is not first
+    assert len(first.df) == 1
+    assert len(second.df) == 2
+
+
+def test_failed_excel_reload_keeps_serving_previous_data(excel_file):
+    """A workbook that cannot be loaded leaves the previous data in place."""
+    async def run():
+        first = await main.get_excel_search()
+        _touch(excel_file, "")
+        second = await main.get_excel_search()
+        return first, second
+    
+    first, second = asyncio.run(run())
+    assert second is first
+    assert first.search_by_name_or_id("ana")
+
+
+def test_singleflight_coalesces_concurrent_calls():
+    """Concurrent callers with the same key share one run of the work."""
+    calls = []
+    
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"dependencia": "Tesorería"}
+    
+    async def run():
+        return await asyncio.gather(*[main.run_singleflight("same", work) for _ in range(5)])
+    
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert not main._inflight
+
+
+def test_singleflight_shares_errors_and_forgets_the_key():
+    """A failure reaches every waiter, and the next call runs the work again."""
+    calls = []
+    
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("extraction failed")
+    
+    async def run():
+        results = await asyncio.gather(*[main.run_singleflight("bad", failing) for _ in range(3)],
+                                       return_exceptions=True)
+        again = await asyncio.gather(main.run_singleflight("bad", failing), return_exceptions=True)
+        return results + again
+    
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 2
+    assert not main._inflight
+
+
+def test_singleflight_leader_cancellation_reruns_for_waiters():
+    """Cancelling the leading request makes one waiter run its own work; the others share it."""
+    calls = []
+    
+    def work_for(tag):
+        async def work():
+            calls.append(tag)
+            await asyncio.sleep(0.05)
+            return tag
+        return work
+    
+    async def run():
+        leader = asyncio.create_task(main.run_singleflight("key", work_for("leader")))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(main.run_singleflight("key", work_for(f"waiter{i}"))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(leader, *waiters, return_exceptions=True)
+    
+    leader_result, *waiter_results = asyncio.run(run())
+    assert isinstance(leader_result, asyncio.CancelledError)
+    assert calls == ["leader", "waiter0"]
+    assert waiter_results == ["waiter0"] * 3
+    assert not main._inflight
+
+
+def test_singleflight_waiter_cancellation_leaves_leader_running():
+    """A waiter cancelled by its own client does not disturb the shared work."""
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+    
+    async def run():
+        leader = asyncio.create_task(main.run_singleflight("key", work))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(main.run_singleflight("key", work))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await asyncio.gather(leader, waiter, return_exceptions=True)
+    
+    leader_result, waiter_result = asyncio.run(run())
+    assert leader_result == "done"
+    assert isinstance(waiter_result, asyncio.CancelledError)
+
+
+def _upload(content: bytes, size=None):
+    return UploadFile(io.BytesIO(content), size=size, filename="peticion.pdf")
+
+
+def test_spool_upload_returns_size_hash_and_rewound_spool(monkeypatch):
+    """Accepted uploads are spooled whole, rewound, and hashed in a single pass."""
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 7)
+    content = b"%PDF-1.7\n" + b"x" * 100
+    
+    spool, size, digest = asyncio.run(main.spool_upload(_upload(content)))
+    with spool:
+        assert size == len(content)
+        assert digest == hashlib.sha256(content).hexdigest()
+        assert spool.read() == content
+
+
+def test_spool_upload_accepts_header_within_magic_window():
+    """Readers tolerate leading bytes before %PDF-, so the first KiB is searched."""
+    content = b"\x00" * 100 + b"%PDF-1.4\n"
+    spool, size, _ = asyncio.run(main.spool_upload(_upload(content)))
+    spool.close()
+    assert size == len(content)
+
+
+def test_spool_upload_rejects_non_pdf_content():
+    """A renamed non-PDF file is rejected with 400 from its first chunk."""
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.spool_upload(_upload(b"PK\x03\x04 not a pdf")))
+    assert error.value.status_code == 400
+
+
+def test_spool_upload_rejects_oversized_uploads(monkeypatch):
+    """Uploads over MAX_UPLOAD_SIZE get 413, whether declared up front or found while streaming."""
+    monkeypatch.setattr(main, "MAX_UPLOAD_SIZE", 64)
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 16)
+    content = b"%PDF-1.7\n" + b"x" * 100
+    
+    with pytest.raises(HTTPException) as declared:
+        asyncio.run(main.spool_upload(_upload(content, size=len(content))))
+    with pytest.raises(HTTPException) as streamed:
+        asyncio.run(main.spool_upload(_upload(content)))
+    assert declared.value.status_code == streamed.value.status_code == 413
+
+
+@pytest.mark.parametrize("key, configured", [("", False), ("   ", False), ("sk-test-1234567890", True)])
+def test_health_body_reports_key_presence_consistently(monkeypatch, key, configured):
+    """Every key-presence field of /health agrees, including for blank keys."""
+    import orjson
+    
+    monkeypatch.setenv("OPENAI_API_KEY", key)
+    monkeypatch.setattr(main, "OPENAI_KEY_PRESENT", bool(key.strip()))
+    body = orjson.loads(main._build_health_body())
+    
+    assert body["openai_configured"] is configured
+    assert body["debug"]["api_key_exists"] is configured
+    assert (body["debug"]["api_key_length"] > 0) is configured
+    assert (body["debug"]["api_key_prefix"] != "None") is configured
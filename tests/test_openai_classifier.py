@@ -0,0 +1,366 @@
+"""
+Tests for utils.openai_classifier (no requests are sent to OpenAI).
+"""
+
+import json
+import re
+
+import pytest
+
+pytest.importorskip("openai")
+
+from utils import openai_classifier
+from utils.openai_classifier import ICETEXClassifier
+
+
+def test_encoding_download_failure_falls_back_to_estimate(monkeypatch):
+    """An unreachable BPE download must not turn every classification into an error."""
+    tiktoken = pytest.importorskip("tiktoken")
+    
+    def offline(*args, **kwargs):
+        raise ConnectionError("HTTPSConnectionPool: offline")
+    
+    monkeypatch.setattr(tiktoken, "encoding_for_model", offline)
+    monkeypatch.setattr(tiktoken, "get_encoding", offline)
+    openai_classifier._get_encoding.cache_clear()
+    try:
+        classifier = ICETEXClassifier(api_key="sk-test", model="offline-model")
+        assert classifier._encoding is None
+        
+        text = "palabra " * (classifier.MAX_PETITION_TOKENS * 2)
+        truncated = classifier._truncate_to_budget(text)
+        assert "[Texto truncado por límite de tokens]" in truncated
+        assert len(truncated) < len(text)
+    finally:
+        openai_classifier._get_encoding.cache_clear()
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    """Classifier with a dummy key and the default model/escalation settings."""
+    for name in ("OPENAI_MODEL", "OPENAI_ESCALATION_MODEL", "OPENAI_ESCALATION_CONFIDENCE"):
+        monkeypatch.delenv(name, raising=False)
+    return ICETEXClassifier(api_key="sk-test")
+
+
+def _answer(confianza):
+    return {"dependencia": "Tesorería", "confianza": confianza, "motivo": "", "palabras_clave": []}
+
+
+def test_metadata_reports_escalation_model(classifier, monkeypatch):
+    """A result re-requested on the escalation model is reported as coming from it."""
+    calls = []
+    
+    def request(petition_text, model):
+        calls.append(model)
+        return _answer("40%" if model == classifier.model else "95%")
+    
+    monkeypatch.setattr(classifier, "_request_classification", request)
+    result = classifier.classify_with_metadata("Solicito la devolución de un pago. " * 3)
+    
+    assert calls == [classifier.model, classifier.escalation_model]
+    assert result["classification"]["confianza"] == "95%"
+    assert result["metadata"]["model"] == classifier.escalation_model
+
+
+def test_metadata_reports_primary_model_without_escalation(classifier, monkeypatch):
+    """Confident results keep the primary model in the metadata."""
+    monkeypatch.setattr(classifier, "_request_classification", lambda text, model: _answer("90%"))
+    result = classifier.classify_with_metadata("Solicito la devolución de un pago. " * 3)
+    assert result["metadata"]["model"] == classifier.model == "gpt-4o-mini"
+
+
+class _FakeResponse(dict):
+    """Chat completion as returned by the legacy SDK (dict access plus .choices)."""
+    
+    def __init__(self, content: str):
+        super().__init__(usage={"prompt_tokens": 10})
+        self.choices = [type("Choice", (), {"message": type("Message", (), {"content": content})()})()]
+
+
+def _petitions(count):
+    return [f"Petición número {i}: solicito información sobre mi crédito." for i in range(count)]
+
+
+def _packed_response(indices):
+    return json.dumps({"clasificaciones": [
+        {"indice": index, "dependencia": f"D{n}", "confianza": "90%", "motivo": "", "palabras_clave": []}
+        for n, index in enumerate(indices)
+    ]})
+
+
+def test_classify_many_maps_items_by_indice(classifier, monkeypatch):
+    """Items are matched to petitions by indice, not by their position in the response."""
+    monkeypatch.setattr(classifier, "_create_completion", lambda **kwargs: _FakeResponse(_packed_response([3, 1, 2])))
+    results = classifier.classify_many(_petitions(3))
+    assert [result["dependencia"] for result in results] == ["D1", "D2", "D0"]
+    assert all("indice" not in result for result in results)
+
+
+def test_classify_many_accepts_non_integer_indice(classifier, monkeypatch):
+    """String, bracketed and float indices still map to their petitions; unusable ones do not."""
+    monkeypatch.setattr(classifier, "_create_completion",
+                        lambda **kwargs: _FakeResponse(_packed_response(["1", "[2]", 3.0, 4.5])))
+    results = classifier.classify_many(_petitions(4))
+    assert [result["dependencia"] for result in results[:3]] == ["D0", "D1", "D2"]
+    assert results[3]["dependencia"] == "Error"
+
+
+def test_classify_many_keeps_short_texts_out_of_the_request(classifier, monkeypatch):
+    """Too-short petitions get an error in place and are not numbered in the request."""
+    requests = []
+    
+    def create(**kwargs):
+        requests.append(kwargs["messages"][1]["content"])
+        return _FakeResponse(_packed_response([1, 2]))
+    
+    monkeypatch.setattr(classifier, "_create_completion", create)
+    texts = _petitions(2)
+    results = classifier.classify_many([texts[0], "corta", texts[1]])
+    
+    assert [result["dependencia"] for result in results] == ["D0", "Error", "D1"]
+    assert "[3]" not in requests[0]
+
+
+def _streamed(*fragments):
+    """Fake streamed completion yielding the given content fragments."""
+    async def create(**kwargs):
+        assert kwargs["stream"] is True
+        
+        async def chunks():
+            for fragment in fragments:
+                yield {"choices": [{"delta": {"content": fragment}}]}
+            yield {"choices": [{"delta": {}}]}
+        return chunks()
+    return create
+
+
+def _collect(classifier, text):
+    import asyncio
+    
+    async def run():
+        return [event async for event in classifier.classify_stream(text)]
+    return asyncio.run(run())
+
+
+def test_classify_stream_event_order(classifier, monkeypatch):
+    """Deltas stream through, dependencia is sent once when complete, and the result comes last."""
+    monkeypatch.setattr(classifier, "_acreate_completion", _streamed(
+        '{"dependencia": "Vicepresidencia ', 'de \\"Crédito\\"", "confi', 'anza": "90%", "motivo": "x", "palabras_clave": []}'
+    ))
+    events = _collect(classifier, "Solicito información sobre mi crédito educativo.")
+    
+    types = [event["type"] for event in events]
+    assert types == ["delta", "delta", "dependencia", "delta", "result"]
+    assert events[2]["dependencia"] == 'Vicepresidencia de "Crédito"'
+    assert events[-1]["classification"]["confianza"] == "90%"
+
+
+def test_classify_stream_ends_with_error_result_on_bad_json(classifier, monkeypatch):
+    """A response that is not JSON still finishes with a result event carrying the error."""
+    monkeypatch.setattr(classifier, "_acreate_completion", _streamed("no es JSON"))
+    events = _collect(classifier, "Solicito información sobre mi crédito educativo.")
+    assert events[-1]["type"] == "result"
+    assert events[-1]["classification"]["dependencia"] == "Error"
+    assert not any(event["type"] == "dependencia" for event in events)
+
+
+def test_classify_stream_short_text_yields_only_result(classifier):
+    events = _collect(classifier, "corta")
+    assert [event["type"] for event in events] == ["result"]
+    assert events[0]["classification"]["dependencia"] == "Error"
+
+
+@pytest.mark.parametrize("use_msgspec", [True, False])
+def test_parse_classification_fills_missing_fields(classifier, monkeypatch, use_msgspec):
+    """Missing fields get their defaults with or without the msgspec decoder."""
+    if use_msgspec and openai_classifier._classification_decoder is None:
+        pytest.skip("msgspec not installed")
+    if not use_msgspec:
+        monkeypatch.setattr(openai_classifier, "_classification_decoder", None)
+    
+    result = classifier._parse_classification('{"dependencia": "Tesorería"}')
+    assert result == {"dependencia": "Tesorería", "confianza": "N/A", "motivo": "N/A", "palabras_clave": []}
+
+
+def test_parse_classification_keeps_unexpected_field_types(classifier):
+    """Valid JSON with off-schema types is kept as the model sent it, not rejected."""
+    result = classifier._parse_classification(
+        '{"dependencia": "Tesorería", "confianza": 85, "motivo": "x", "palabras_clave": "pago", "extra": 1}'
+    )
+    assert result["confianza"] == 85
+    assert result["palabras_clave"] == "pago"
+
+
+def test_parse_classification_rejects_non_json(classifier):
+    with pytest.raises(openai_classifier.JSON_DECODE_ERRORS):
+        classifier._parse_classification("Tesorería")
+
+
+class _FakeBatchAPI:
+    """Stands in for the legacy SDK's File resource and the /batches endpoint."""
+    
+    def __init__(self, statuses, output_lines=()):
+        self.statuses = list(statuses)
+        self.output_lines = list(output_lines)
+        self.uploaded = None
+        self.File = self
+    
+    def create(self, file, purpose, user_provided_filename):
+        self.uploaded = [json.loads(line) for line in file.read().decode("utf-8").splitlines()]
+        return {"id": "file-in"}
+    
+    def download(self, file_id):
+        return "\n".join(json.dumps(line) for line in self.output_lines).encode("utf-8")
+    
+    def request(self, method, url, params=None):
+        if method == "post":
+            return {"id": "batch-1"}
+        status = self.statuses.pop(0)
+        return {"status": status, "output_file_id": "file-out" if status == "completed" else None}
+
+
+def _batch_line(i, content=None, status_code=200):
+    body = {"choices": [{"message": {"content": content}}], "usage": {"prompt_tokens": 5}}
+    return {"custom_id": f"pet-{i}", "response": {"status_code": status_code, "body": body}}
+
+
+def test_classify_batch_maps_results_by_custom_id(classifier, monkeypatch):
+    """Output lines are matched by custom_id; failures and absences become per-petition errors."""
+    answer = json.dumps(_answer("90%"))
+    api = _FakeBatchAPI(
+        statuses=["in_progress", "completed"],
+        output_lines=[_batch_line(2, "no es JSON"), _batch_line(0, answer), _batch_line(1, answer, status_code=500)],
+    )
+    monkeypatch.setattr(classifier, "client", api)
+    monkeypatch.setattr(classifier, "_api_request", api.request)
+    monkeypatch.setattr(openai_classifier.time, "sleep", lambda seconds: None)
+    
+    texts = _petitions(4)
+    results = classifier.classify_batch([texts[0], "corta", texts[1], texts[2], texts[3]])
+    
+    assert [line["custom_id"] for line in api.uploaded] == ["pet-0", "pet-1", "pet-2", "pet-3"]
+    assert results[0]["dependencia"] == "Tesorería"
+    assert results[1]["motivo"].startswith("The petition text is too short")
+    assert "status 500" in results[2]["motivo"]
+    assert results[3]["motivo"].startswith("Failed to parse")
+    assert "status 'completed'" in results[4]["motivo"]
+
+
+def test_classify_batch_times_out_as_errors(classifier, monkeypatch):
+    """A batch still running at the deadline yields error results instead of blocking."""
+    api = _FakeBatchAPI(statuses=["in_progress"] * 5)
+    monkeypatch.setattr(classifier, "client", api)
+    monkeypatch.setattr(classifier, "_api_request", api.request)
+    monkeypatch.setattr(openai_classifier.time, "sleep", lambda seconds: None)
+    
+    results = classifier.classify_batch(_petitions(2), timeout=0)
+    assert all("did not finish" in result["motivo"] for result in results)
+
+
+def _rate_limited(headers=None):
+    return openai_classifier.RateLimitError("rate limited", headers=headers)
+
+
+def test_retry_delay_uses_full_jitter_within_bounds(classifier, monkeypatch):
+    """Backoff is uniform in [0, base * 2**attempt], capped at RETRY_MAX_DELAY."""
+    samples = {classifier._retry_delay(_rate_limited(), 3) for _ in range(50)}
+    assert len(samples) > 1
+    assert all(0 <= delay <= classifier.RETRY_BASE_DELAY * 8 for delay in samples)
+    
+    bounds = []
+    monkeypatch.setattr(openai_classifier.random, "uniform", lambda low, high: bounds.append((low, high)) or high)
+    delays = [classifier._retry_delay(_rate_limited(), attempt) for attempt in range(8)]
+    
+    assert bounds == [(0, min(classifier.RETRY_BASE_DELAY * 2 ** attempt, classifier.RETRY_MAX_DELAY))
+                      for attempt in range(8)]
+    assert delays[-1] == classifier.RETRY_MAX_DELAY
+
+
+def test_retry_delay_honors_retry_after_headers(classifier):
+    """retry-after-ms wins over retry-after; both are capped and bad values fall back to backoff."""
+    assert classifier._retry_delay(_rate_limited({"retry-after-ms": "1500", "retry-after": "9"}), 0) == 1.5
+    assert classifier._retry_delay(_rate_limited({"retry-after": "2"}), 0) == 2.0
+    assert classifier._retry_delay(_rate_limited({"retry-after": "3600"}), 0) == classifier.RETRY_MAX_DELAY
+    assert 0 <= classifier._retry_delay(_rate_limited({"retry-after": "soon"}), 0) <= classifier.RETRY_BASE_DELAY
+
+
+def test_create_completion_retries_transient_errors_only(classifier, monkeypatch):
+    """Retryable errors are retried up to max_retries; other errors are raised at once."""
+    sleeps = []
+    monkeypatch.setattr(openai_classifier.time, "sleep", sleeps.append)
+    monkeypatch.setattr(classifier, "max_retries", 2)
+    
+    outcomes = [_rate_limited({"retry-after": "1"}), _rate_limited({"retry-after": "1"}), "ok"]
+    
+    def create(**kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    
+    monkeypatch.setattr(classifier.client.ChatCompletion, "create", create)
+    assert classifier._create_completion(model="m") == "ok"
+    assert sleeps == [1.0, 1.0]
+    
+    outcomes[:] = [_rate_limited()] * 3
+    with pytest.raises(openai_classifier.RateLimitError):
+        classifier._create_completion(model="m")
+    
+    outcomes[:] = [ValueError("bad request")]
+    with pytest.raises(ValueError):
+        classifier._create_completion(model="m")
+    assert len(sleeps) == 4
+
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"dependencia": "Tesorería"}\n```',
+    '```\n{"dependencia": "Tesorería"}\n```',
+    'Aquí está la clasificación: {"dependencia": "Tesorería"} Espero que sirva.',
+    '  {"dependencia": "Tesorería"}\n',
+])
+def test_decode_json_response_recovers_wrapped_object(text):
+    """JSON wrapped in markdown fences or prose is decoded from its outermost object."""
+    assert openai_classifier._decode_json_response(json.loads, text) == {"dependencia": "Tesorería"}
+
+
+def test_decode_json_response_keeps_nested_objects():
+    text = 'Resultado:\n```json\n{"clasificaciones": [{"indice": 1}, {"indice": 2}]}\n```'
+    assert openai_classifier._decode_json_response(json.loads, text)["clasificaciones"][1] == {"indice": 2}
+
+
+@pytest.mark.parametrize("text", [
+    '{"dependencia": "Tesorería", "confianza": "9',
+    '```json\n{"dependencia": "Tesorería",\n```',
+    'Sin JSON en la respuesta',
+])
+def test_decode_json_response_raises_on_partial_json(text):
+    """Truncated or missing JSON raises a decode error rather than returning a partial result."""
+    with pytest.raises(openai_classifier.JSON_DECODE_ERRORS):
+        openai_classifier._decode_json_response(json.loads, text)
+
+
+def test_classify_many_splits_into_packs_in_input_order(classifier, monkeypatch):
+    """More petitions than PACK_SIZE go out in packs of at most PACK_SIZE, results in input order."""
+    pack_sizes = []
+    
+    def create(**kwargs):
+        user = kwargs["messages"][-1]["content"]
+        if "petitions:" not in user:
+            # A pack left with one petition is classified on its own
+            pack_sizes.append(1)
+            number = int(re.search(r"número (\d+)", user).group(1))
+            return _FakeResponse(json.dumps({**_answer("90%"), "dependencia": f"P{number}"}))
+        numbers = [int(n) for n in re.findall(r"número (\d+)", user)]
+        pack_sizes.append(len(numbers))
+        return _FakeResponse(json.dumps({"clasificaciones": [
+            {**_answer("90%"), "indice": position, "dependencia": f"P{number}"}
+            for position, number in enumerate(numbers, 1)
+        ]}))
+    
+    monkeypatch.setattr(classifier, "_create_completion", create)
+    count = 2 * classifier.PACK_SIZE + 1
+    results = classifier.classify_many(_petitions(count))
+    
+    assert pack_sizes == [classifier.PACK_SIZE, classifier.PACK_SIZE, 1]
+    assert [result["dependencia"] for result in results] == [f"P{i}" for i in range(count)]
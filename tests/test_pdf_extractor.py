@@ -0,0 +1,64 @@
+"""
+Regression tests for utils.pdf_extractor.
+"""
+
+import io
+
+import pytest
+
+pytest.importorskip("pdfplumber")
+canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+
+from utils.pdf_extractor import PDFExtractor
+
+BODY = "Solicito la condonacion del credito educativo del Fondo Bicentenario."
+
+
+def _mixed_pdf() -> bytes:
+    """A PDF whose first two pages have no text layer (scan-like), followed by a digital page."""
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for _ in range(2):
+        pdf.rect(100, 100, 300, 500, fill=1)
+        pdf.showPage()
+    for line, y in enumerate(range(750, 450, -20)):
+        pdf.drawString(72, y, f"{line}. {BODY}")
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def test_mixed_pdf_keeps_text_layer_when_ocr_fails(monkeypatch):
+    """A scanned cover must not hide the digital pages behind it when OCR is unavailable."""
+    extractor = PDFExtractor(workers=1)
+
+    def ocr_unavailable(pdf_path):
+        raise Exception("OCR extraction failed: tesseract is not installed")
+
+    monkeypatch.setattr(extractor, "_extract_with_ocr", ocr_unavailable)
+
+    text = extractor.extract_from_bytes(_mixed_pdf())
+    assert BODY in text
+    assert "[Nota: OCR no disponible" in text
+
+
+def test_spooled_upload_is_read_without_temp_file(monkeypatch):
+    """Text PDFs in a spooled upload are read in place, not copied to a named temp file."""
+    import tempfile
+    from utils import pdf_extractor
+
+    def no_temp_file(*args, **kwargs):
+        raise AssertionError("unexpected temporary file")
+
+    monkeypatch.setattr(pdf_extractor.tempfile, "NamedTemporaryFile", no_temp_file)
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for line, y in enumerate(range(750, 450, -20)):
+        pdf.drawString(72, y, f"{line}. {BODY}")
+    pdf.save()
+
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spool:
+        spool.write(buffer.getvalue())
+        text = PDFExtractor(workers=1).extract_from_stream(spool)
+    assert BODY in text
@@ -0,0 +1,99 @@
+"""
+Regression tests for utils.pdf_generator.
+"""
+
+import random
+
+import pytest
+
+pytest.importorskip("reportlab")
+
+from utils.pdf_generator import PDFGenerator, NAME_KEY, ID_KEY, CONTRACT_KEY
+
+
+def _random_results(rng: random.Random, count: int):
+    """Results sharing the same columns, with values of varied lengths."""
+    columns = [f"COLUMNA_{i}" for i in range(rng.randint(5, 25))]
+    results = []
+    for i in range(count):
+        result = {NAME_KEY: f"CONTRATISTA {i}", ID_KEY: 1000 + i}
+        for column in columns:
+            result[column] = "VALOR " * rng.randint(1, 40)
+        results.append(result)
+    return results
+
+
+def test_multi_page_exports_build():
+    """Repeated columns landing at page bottoms must not raise LayoutError."""
+    rng = random.Random(1234)
+    generator = PDFGenerator()
+    for _ in range(60):
+        results = _random_results(rng, rng.randint(1, 4))
+        pdf = generator.generate_result_pdf(results, "consulta").getvalue()
+        assert pdf.startswith(b"%PDF")
+
+
+def test_wide_single_line_values_wrap():
+    """A short value drawn wider than the frame must become a wrapping Paragraph."""
+    from reportlab.platypus import Paragraph, Preformatted
+    from utils.pdf_generator import TEXT_WIDTH
+
+    generator = PDFGenerator()
+    style = generator._styles['value']
+    wide = "W" * 50
+    narrow = "1234567890"
+
+    assert isinstance(generator._field_text(wide, style), Paragraph)
+    assert isinstance(generator._field_text(narrow, style), Preformatted)
+
+    width, _ = generator._field_text(wide, style).wrap(TEXT_WIDTH, 1000)
+    assert width <= TEXT_WIDTH
+
+
+def test_format_key_matches_column_label():
+    """Memoized labels read the same as formatting the column name directly."""
+    from utils.pdf_generator import _format_key
+
+    for key in ("valor_contrato", "FECHA_DE_INICIO", ID_KEY, CONTRACT_KEY):
+        assert _format_key(key) == key.replace('_', ' ').title()
+        assert _format_key(key) is _format_key(key)
+
+
+def test_heading_fallbacks_match_column_presence(monkeypatch):
+    """Headings fall back by column presence: a present but empty name is kept."""
+    import utils.pdf_generator as pdf_generator
+
+    headers = []
+    real_paragraph = pdf_generator.Paragraph
+
+    def recording_paragraph(text, style, *args, **kwargs):
+        if style.name in ('CustomHeader', 'IdStyle'):
+            headers.append(text)
+        return real_paragraph(text, style, *args, **kwargs)
+
+    monkeypatch.setattr(pdf_generator, "Paragraph", recording_paragraph)
+    PDFGenerator().generate_result_pdf([
+        {NAME_KEY: "", CONTRACT_KEY: "2024-0026", ID_KEY: 99},
+        {CONTRACT_KEY: "2024-0027"},
+        {"OTRO": "x"},
+    ], "consulta")
+
+    assert headers == [
+        "Resultado 1: ",
+        "<b>ID:</b> 99",
+        "Resultado 2: 2024-0027",
+        "<b>ID:</b> 2024-0027",
+        "Resultado 3: Resultado 3",
+    ]
+
+
+def test_escape_html_escapes_markup_characters():
+    """All five markup characters are escaped; text without them is returned unchanged."""
+    generator = PDFGenerator()
+    plain = "JUAN PEREZ 1234"
+
+    assert generator._escape_html(plain) is plain
+    assert generator._escape_html("A&B <C> \"D\" 'E'") == "A&amp;B &lt;C&gt; &quot;D&quot; &#39;E&#39;"
+    assert generator._escape_html("&lt;") == "&amp;lt;"
+    assert generator._escape_html(None) == ""
+    assert generator._escape_html(1234) == "1234"
@@ -0,0 +1,52 @@
+"""
+Tests for utils.text_prep.
+"""
+
+from utils.text_prep import condense, OMISSION_MARKER
+
+
+HEAD = "Señores ICETEX, Bogotá, enero de 2024. " * 50
+TAIL = " Atentamente, Juan Pérez, C.C. 1234."
+
+
+def _petition(middle_sentences):
+    return HEAD + " ".join(middle_sentences) + TAIL
+
+
+def test_short_text_is_returned_unchanged():
+    text = "Solicito el estado de mi crédito."
+    assert condense(text, max_chars=100) is text
+
+
+def test_keeps_head_tail_and_keyword_sentences_in_order():
+    """Head and tail survive; middle sentences are kept only when they carry a decision keyword."""
+    filler = ["El día estaba soleado y caminé hasta la oficina." for _ in range(200)]
+    middle = (filler[:100] + ["Tengo una deuda en mora con la cartera."]
+              + filler[100:150] + ["Presento una tutela por el fallo."] + filler[150:])
+    text = _petition(middle)
+    
+    condensed = condense(text, max_chars=3000, head_chars=1500, tail_chars=500)
+    
+    assert len(condensed) <= 3000
+    assert condensed.startswith(text[:1500])
+    assert condensed.endswith(text[-500:])
+    assert condensed.count(OMISSION_MARKER) == 2
+    body = condensed[1500:-500]
+    assert body.index("deuda en mora") < body.index("tutela por el fallo")
+    assert "soleado" not in body
+
+
+def test_keywords_match_without_accents_or_case():
+    """Accented and capitalized forms match the accent-free keyword stems."""
+    filler = ["Nada relevante aquí." for _ in range(400)]
+    text = _petition(filler + ["RESOLUCIÓN de CONDONACIÓN pendiente."])
+    condensed = condense(text, max_chars=2600)
+    assert "RESOLUCIÓN de CONDONACIÓN pendiente." in condensed
+
+
+def test_no_keyword_sentences_leaves_a_single_marker():
+    """Without keyword sentences only head, one marker and tail remain, within the budget."""
+    text = _petition(["Nada relevante aquí." for _ in range(400)])
+    condensed = condense(text, max_chars=2500)
+    assert condensed == "\n".join([text[:1500], OMISSION_MARKER, text[-500:]])
+    assert len(condensed) <= 2500
@@ -1,10 +1,24 @@
 """
 Utility modules for ICETEX petition classification system.
+
+Classes are re-exported lazily (PEP 562) so importing the package does not
+pull in pdfplumber, openai or pandas until a class is actually used.
 """
 
-from .pdf_extractor import PDFExtractor
-from .openai_classifier import ICETEXClassifier
-from .knowledge_base import ICETEXKnowledgeBase
+import importlib
+
+_EXPORTS = {
+    'PDFExtractor': '.pdf_extractor',
+    'ICETEXClassifier': '.openai_classifier',
+    'ICETEXKnowledgeBase': '.knowledge_base',
+}
 
 __all__ = ['PDFExtractor', 'ICETEXClassifier', 'ICETEXKnowledgeBase']
 
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
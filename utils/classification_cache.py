@@ -0,0 +1,175 @@
+"""
+Classification cache for ICETEX petitions.
+Two tiers: exact hits keyed by the SHA-256 of the extracted text, and
+near-duplicate hits found by cosine similarity over petition embeddings.
+"""
+
+import hashlib
+import logging
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ClassificationCache:
+    """
+    In-memory cache of classification results.
+
+    Classifications are informational only (no side effects), so a cached
+    result can safely be returned for a repeated or near-identical petition.
+    """
+
+    def __init__(
+        self,
+        cache_path: Optional[str] = None,
+        max_entries: int = 1024,
+        similarity_threshold: float = 0.93
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_path: File used to persist the cache between restarts (None disables persistence)
+            max_entries: Maximum number of cached classifications (least recently used are evicted)
+            similarity_threshold: Minimum cosine similarity for a near-duplicate hit
+        """
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+
+        self.load()
+
+    @staticmethod
+    def make_key(text: str, namespace: str = "") -> str:
+        """
+        Return the exact-match cache key for a petition text.
+
+        Args:
+            text: Extracted petition text
+            namespace: Classifier fingerprint (model and system prompt), so results
+                cached under a different model or prompt are not reused
+        """
+        return hashlib.sha256(f"{namespace}|{text}".encode('utf-8')).hexdigest()
+
+    def get_exact(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached classification for an exact key, if any."""
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+        return result
+
+    def get_similar(self, embedding: Optional[List[float]]) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached classification of the most similar petition.
+
+        Args:
+            embedding: Embedding vector of the petition being classified
+
+        Returns:
+            Cached classification if the best similarity reaches the threshold, else None
+        """
+        if embedding is None or not self._embeddings:
+            return None
+
+        query = self._normalize(embedding)
+        matrix = self._get_matrix()
+        if matrix.shape[1] != query.shape[0]:
+            return None
+
+        similarities = matrix @ query
+        best = int(similarities.argmax())
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        return self.get_exact(self._matrix_keys[best])
+
+    def put(self, key: str, result: Dict[str, Any], embedding: Optional[List[float]] = None):
+        """
+        Store a classification result.
+
+        Args:
+            key: Exact-match key from make_key()
+            result: Classification dictionary to cache
+            embedding: Optional embedding vector for near-duplicate lookups
+        """
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+
+        if embedding is not None:
+            self._embeddings[key] = self._normalize(embedding)
+            self._matrix = None
+
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            if self._embeddings.pop(evicted, None) is not None:
+                self._matrix = None
+
+    def clear(self):
+        """Remove every cached classification."""
+        self._entries.clear()
+        self._embeddings.clear()
+        self._matrix = None
+        self._matrix_keys = []
+
+    def load(self):
+        """Load a previously persisted cache from disk, if present."""
+        if not self.cache_path or not self.cache_path.exists():
+            return
+
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = pickle.load(f)
+            self._entries = OrderedDict(data.get("entries", {}))
+            self._embeddings = {
+                key: np.asarray(vector, dtype=np.float32)
+                for key, vector in data.get("embeddings", {}).items()
+                if key in self._entries
+            }
+            self._matrix = None
+            logger.info("Loaded %d cached classifications", len(self._entries))
+        except Exception as e:
+            logger.warning("Could not load classification cache: %s", e)
+            self.clear()
+
+    def save(self):
+        """Persist the cache to disk."""
+        if not self.cache_path:
+            return
+
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_path, 'wb') as f:
+                pickle.dump(
+                    {"entries": dict(self._entries), "embeddings": self._embeddings},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+        except Exception as e:
+            logger.error("Error saving classification cache: %s", e)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_matrix(self) -> np.ndarray:
+        """Stack the stored embeddings into a (N, dim) matrix, rebuilding only after changes."""
+        if self._matrix is None:
+            self._matrix_keys = list(self._embeddings.keys())
+            self._matrix = np.stack([self._embeddings[key] for key in self._matrix_keys])
+        return self._matrix
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        """Return the embedding as a unit-length float32 vector."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
@@ -3,10 +3,70 @@ Excel search utility for searching records by name or ID.
 """
 
 import os
+import pickle
+import re
+import logging
 import pandas as pd
-from typing import Optional, List, Dict, Any
+import numpy as np
+from pandas.io.parsers import TextParser
+from datetime import date, timedelta
+from typing import Optional, List, Dict, Any, Tuple
 from pathlib import Path
 
+try:
+    # Optional: vectorized substring scans (falls back to pandas .str.contains)
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+try:
+    # Optional: Rust-based XLSX reader, much faster and lighter than openpyxl
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+logger = logging.getLogger(__name__)
+
+# Column-name keywords (matched against the lowercased header, based on the user's Excel structure)
+NAME_COLUMN_KEYWORDS = [
+    'nombre', 'name', 'apellido', 'surname', 'completo', 'full',
+    'primer', 'segundo', 'primer_nombre', 'segundo_nombre',
+    'razon social', 'razón social', 'representante legal'
+]
+ID_COLUMN_KEYWORDS = [
+    'id', 'cedula', 'cedula_ciudadania', 'cédula', 'documento', 'document',
+    'numero', 'número', 'numero_documento', 'identificacion', 'identificación',
+    'dni', 'pasaporte', 'nit'
+]
+NAME_COLUMN_PATTERN = re.compile("|".join(re.escape(keyword) for keyword in NAME_COLUMN_KEYWORDS))
+ID_COLUMN_PATTERN = re.compile("|".join(re.escape(keyword) for keyword in ID_COLUMN_KEYWORDS))
+
+# Joins a row's searchable values into one string; queries containing it skip the row blobs
+ROW_BLOB_SEPARATOR = "\x1f"
+
+# Search terms shorter than this (after stripping) return no results
+MIN_SEARCH_LENGTH = 2
+
+# Bumped when the parsed frame changes for the same workbook, so older caches are rebuilt
+CACHE_VERSION = 2
+
+
+def _convert_calamine_cell(value):
+    """Convert a calamine cell value to what pandas' Excel readers produce."""
+    if isinstance(value, str):
+        # calamine keeps the workbook's '\r\n' line breaks; openpyxl's XML parser normalizes them to '\n'
+        return value.replace('\r\n', '\n') if '\r' in value else value
+    if isinstance(value, float):
+        as_int = int(value)
+        return as_int if as_int == value else value
+    if isinstance(value, date):
+        return pd.Timestamp(value)
+    if isinstance(value, timedelta):
+        return pd.Timedelta(value)
+    return value
+
 
 class ExcelSearch:
     """Search utility for Excel files."""
@@ -24,7 +84,20 @@ class ExcelSearch:
             excel_file_path = project_root / "data" / "contratos_icetex.xlsx"
         
         self.excel_file_path = Path(excel_file_path)
+        # Parsed copy of the sheet next to the workbook, reused while the workbook is unchanged
+        self.cache_path = self.excel_file_path.with_suffix('.pkl')
         self.df = None
+        self.loaded_mtime = None
+        self._str_cache: Dict[Any, pd.Series] = {}
+        self._lower_cache: Dict[Any, pd.Series] = {}
+        self._arrow_cache: Dict[Any, Any] = {}
+        self._row_blobs: Optional[List[str]] = None
+        self._row_blob_array = None
+        self._record_frame: Optional[pd.DataFrame] = None
+        self._record_columns: List[Any] = []
+        self._record_rows: List[List[Any]] = []
+        self._name_columns: Optional[List[str]] = None
+        self._id_columns: Optional[List[str]] = None
         self._load_excel()
     
     def _load_excel(self):
@@ -45,38 +118,209 @@ class ExcelSearch:
             )
         
         try:
+            is_workbook = self.excel_file_path.suffix.lower() in ['.xlsx', '.xls']
+            self.df = self._read_cached_frame() if is_workbook else None
+            if self.df is not None:
+                logger.info("Loaded Excel data from cache: %s", self.cache_path.name)
             # Try reading as .xlsx first
-            if self.excel_file_path.suffix.lower() in ['.xlsx', '.xls']:
+            elif is_workbook and CalamineWorkbook is not None:
+                self.df = self._read_with_calamine()
+                self._write_cached_frame()
+            elif is_workbook:
                 # Try to read from 'CONTRATOS' sheet first, fallback to first sheet
                 try:
-                    self.df = pd.read_excel(self.excel_file_path, engine='openpyxl', sheet_name='CONTRATOS')
-                    print(f"✅ Loaded Excel from 'CONTRATOS' sheet")
+                    self.df = pd.read_excel(self.excel_file_path, sheet_name='CONTRATOS')
+                    logger.info("Loaded Excel from 'CONTRATOS' sheet")
                 except (ValueError, KeyError):
                     # If CONTRATOS sheet doesn't exist, use first sheet
-                    self.df = pd.read_excel(self.excel_file_path, engine='openpyxl')
-                    print(f"✅ Loaded Excel from first sheet")
+                    self.df = pd.read_excel(self.excel_file_path)
+                    logger.info("Loaded Excel from first sheet")
+                self._write_cached_frame()
             else:
                 # Try CSV as fallback
                 self.df = pd.read_csv(self.excel_file_path)
             
             # Store original dtypes for reference
             self.original_dtypes = self.df.dtypes.to_dict()
+            self.loaded_mtime = os.path.getmtime(self.excel_file_path)
             
-            print(f"✅ Excel file loaded successfully: {len(self.df)} rows, {len(self.df.columns)} columns")
+            # String views of the searchable columns are built once per load
+            self._name_columns = None
+            self._id_columns = None
+            self._str_cache = {}
+            self._lower_cache = {}
+            self._arrow_cache = {}
+            for col in dict.fromkeys(self._detect_name_columns() + self._detect_id_columns()):
+                self._column_strings(col)
+                self._column_strings(col, lower=True)
+            self._build_row_blobs()
+            self._build_record_frame()
+            
+            logger.info("Excel file loaded successfully: %d rows, %d columns", len(self.df), len(self.df.columns))
             
         except Exception as e:
             raise Exception(f"Error loading Excel file: {str(e)}")
     
+    def _read_with_calamine(self) -> pd.DataFrame:
+        """Read the 'CONTRATOS' sheet (or the first sheet) with python-calamine."""
+        workbook = CalamineWorkbook.from_path(str(self.excel_file_path))
+        if 'CONTRATOS' in workbook.sheet_names:
+            sheet = workbook.get_sheet_by_name('CONTRATOS')
+            logger.info("Loaded Excel from 'CONTRATOS' sheet")
+        else:
+            sheet = workbook.get_sheet_by_index(0)
+            logger.info("Loaded Excel from first sheet")
+        
+        rows = [[_convert_calamine_cell(value) for value in row] for row in sheet.to_python(skip_empty_area=False)]
+        # Same parser pd.read_excel uses, so headers, blank rows and dtypes are handled identically
+        return TextParser(rows, header=0).read()
+    
+    def _source_signature(self) -> Tuple[float, int]:
+        """Return the workbook's (mtime, size), used to tell whether the cache is stale."""
+        stat = self.excel_file_path.stat()
+        return stat.st_mtime, stat.st_size
+    
+    def _read_cached_frame(self) -> Optional[pd.DataFrame]:
+        """
+        Return the cached DataFrame if it was built from the current workbook.
+        
+        Returns:
+            Cached DataFrame, or None when there is no usable cache
+        """
+        if not self.cache_path.exists():
+            return None
+        
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get("version") != CACHE_VERSION or data.get("source") != self._source_signature():
+                return None
+            
+            df = data["df"]
+            # Unpickled object arrays carry a non-canonical object dtype, which makes
+            # pandas' astype(str) write into the source array instead of a copy
+            for position, dtype in enumerate(df.dtypes):
+                if dtype == object:
+                    df.isetitem(position, df.iloc[:, position].to_numpy().astype(object))
+            return df
+        except Exception as e:
+            logger.warning("Could not read Excel cache %s: %s", self.cache_path, e)
+            return None
+    
+    def _write_cached_frame(self):
+        """Persist the freshly parsed DataFrame so the next load skips the XLSX parse."""
+        tmp_path = self.cache_path.with_suffix('.pkl.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(
+                    {"version": CACHE_VERSION, "source": self._source_signature(), "df": self.df},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.warning("Could not write Excel cache %s: %s", self.cache_path, e)
+    
     def reload(self):
-        """Reload the Excel file from disk."""
+        """Reload the Excel file from disk, discarding the cached copy."""
+        try:
+            self.cache_path.unlink()
+        except FileNotFoundError:
+            pass
         self._load_excel()
     
+    def is_modified(self) -> bool:
+        """Check whether the Excel file changed on disk since it was loaded."""
+        try:
+            return os.path.getmtime(self.excel_file_path) != self.loaded_mtime
+        except OSError:
+            return False
+    
+    def _column_strings(self, col, lower: bool = False) -> pd.Series:
+        """
+        Return a column converted to str (optionally lowercased), cached until the next load.
+        
+        Args:
+            col: Column name
+            lower: Return the lowercased values
+        """
+        cache = self._lower_cache if lower else self._str_cache
+        values = cache.get(col)
+        if values is None:
+            values = self.df[col].astype(str)
+            if lower:
+                values = values.str.lower()
+            cache[col] = values
+        return values
+    
+    def _arrow_strings(self, col, lower: bool = False):
+        """Return the cached str values of a column as a PyArrow string array."""
+        key = (col, lower)
+        values = self._arrow_cache.get(key)
+        if values is None:
+            values = pa.array(self._column_strings(col, lower=lower).to_numpy(), type=pa.string())
+            self._arrow_cache[key] = values
+        return values
+    
+    def _substring_mask(self, columns: List[str], term: str, lower: bool) -> np.ndarray:
+        """
+        Boolean row mask of values containing term in any of the columns (PyArrow kernels).
+        
+        Args:
+            columns: Columns to scan (must exist in the DataFrame)
+            term: Substring to look for (already lowercased when lower is True)
+            lower: Scan the lowercased column values
+        """
+        mask = None
+        for col in columns:
+            matched = pc.match_substring(self._arrow_strings(col, lower=lower), term)
+            mask = matched if mask is None else pc.or_(mask, matched)
+        
+        if mask is None:
+            return np.zeros(len(self.df), dtype=bool)
+        return mask.to_numpy(zero_copy_only=False)
+    
+    def _column_contains(self, col, search_term_lower: str):
+        """Boolean mask of rows whose lowercased value in col contains the term."""
+        if pc is not None:
+            return self._substring_mask([col], search_term_lower, lower=True)
+        return self._column_strings(col, lower=True).str.contains(search_term_lower, na=False, regex=False)
+    
+    def _searchable_columns(self) -> List[str]:
+        """Auto-detected name and ID columns present in the DataFrame, without duplicates."""
+        return [col for col in dict.fromkeys(self._detect_name_columns() + self._detect_id_columns())
+                if col in self.df.columns]
+    
+    def _build_row_blobs(self):
+        """
+        Concatenate each row's lowercased searchable values into a single string.
+        
+        A default search then needs one substring pass per row instead of one per column.
+        """
+        columns = self._searchable_columns()
+        if not columns:
+            self._row_blobs = None
+            self._row_blob_array = None
+            return
+        
+        first, *others = (self._column_strings(col, lower=True) for col in columns)
+        blobs = first.str.cat(others, sep=ROW_BLOB_SEPARATOR) if others else first
+        self._row_blobs = blobs.tolist()
+        self._row_blob_array = pa.array(self._row_blobs, type=pa.string()) if pa is not None else None
+    
+    def _row_blob_mask(self, search_term_lower: str) -> np.ndarray:
+        """Boolean row mask of default-column matches, computed over the row blobs."""
+        if self._row_blob_array is not None:
+            return pc.match_substring(self._row_blob_array, search_term_lower).to_numpy(zero_copy_only=False)
+        return np.fromiter((search_term_lower in blob for blob in self._row_blobs), dtype=bool, count=len(self._row_blobs))
+    
     def search_by_name_or_id(
         self, 
         search_term: str, 
         name_columns: Optional[List[str]] = None,
         id_columns: Optional[List[str]] = None,
-        case_sensitive: bool = False
+        case_sensitive: bool = False,
+        limit: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         Search for records by name or ID.
@@ -86,13 +330,25 @@ class ExcelSearch:
             name_columns: List of column names to search in for names
             id_columns: List of column names to search in for IDs
             case_sensitive: Whether the search should be case-sensitive
+            limit: Maximum number of records to return (None returns all matches)
             
         Returns:
             List of matching records as dictionaries
         """
-        if self.df is None or self.df.empty:
+        # Shorter terms match most of the sheet, so they are not worth scanning for
+        if self.df is None or self.df.empty or len(search_term.strip()) < MIN_SEARCH_LENGTH:
             return []
         
+        # Convert search term based on case sensitivity
+        search_term_lower = search_term.lower() if not case_sensitive else search_term
+        
+        # Fast path: one substring pass over the per-row blobs of all default columns
+        # (an exact ID or whole word is also a substring match, so nothing is missed; an
+        # exact-ID dict could not answer alone, since rows whose ID contains the term match too)
+        if name_columns is None and id_columns is None and not case_sensitive:
+            if self._row_blobs is not None and ROW_BLOB_SEPARATOR not in search_term_lower:
+                return self._records_to_dicts(self.df[self._row_blob_mask(search_term_lower)], limit)
+        
         # Auto-detect columns if not provided
         if name_columns is None:
             name_columns = self._detect_name_columns()
@@ -100,8 +356,11 @@ class ExcelSearch:
         if id_columns is None:
             id_columns = self._detect_id_columns()
         
-        # Convert search term based on case sensitivity
-        search_term_lower = search_term.lower() if not case_sensitive else search_term
+        # An exact ID match is also a substring match, so one scan over every column suffices
+        if pc is not None:
+            columns = [col for col in dict.fromkeys(list(name_columns) + list(id_columns)) if col in self.df.columns]
+            mask = self._substring_mask(columns, search_term_lower, lower=not case_sensitive)
+            return self._records_to_dicts(self.df[mask], limit)
         
         # Search in all relevant columns
         mask = pd.Series([False] * len(self.df))
@@ -109,80 +368,77 @@ class ExcelSearch:
         # Search in name columns
         for col in name_columns:
             if col in self.df.columns:
-                if case_sensitive:
-                    mask = mask | self.df[col].astype(str).str.contains(search_term, na=False, regex=False)
-                else:
-                    mask = mask | self.df[col].astype(str).str.lower().str.contains(search_term_lower, na=False, regex=False)
+                values = self._column_strings(col, lower=not case_sensitive)
+                mask = mask | values.str.contains(search_term_lower, na=False, regex=False)
+                if mask.all():
+                    break
         
         # Search in ID columns (exact match preferred)
         for col in id_columns:
+            if mask.all():
+                break
             if col in self.df.columns:
                 # Try exact match first, then partial match
-                if case_sensitive:
-                    exact_match = self.df[col].astype(str) == search_term
-                    partial_match = self.df[col].astype(str).str.contains(search_term, na=False, regex=False)
-                else:
-                    exact_match = self.df[col].astype(str).str.lower() == search_term_lower
-                    partial_match = self.df[col].astype(str).str.lower().str.contains(search_term_lower, na=False, regex=False)
+                values = self._column_strings(col, lower=not case_sensitive)
+                exact_match = values == search_term_lower
+                partial_match = values.str.contains(search_term_lower, na=False, regex=False)
                 
                 mask = mask | exact_match | partial_match
         
         # Filter results
         results_df = self.df[mask]
         
-        # Convert to list of dictionaries
-        results = results_df.to_dict('records')
+        return self._records_to_dicts(results_df, limit)
+    
+    def _build_record_frame(self):
+        """
+        Precompute the JSON-ready version of every row (once per load).
         
-        # Convert numpy types to Python native types for JSON serialization
-        for record in results:
-            for key, value in record.items():
-                if pd.isna(value):
-                    record[key] = None
-                elif pd.api.types.is_integer_dtype(type(value)):
-                    record[key] = int(value) if not pd.isna(value) else None
-                elif pd.api.types.is_float_dtype(type(value)):
-                    record[key] = float(value) if not pd.isna(value) else None
+        Float columns holding only whole numbers (IDs, amounts read as float
+        because of empty cells) become integers, values are Python objects,
+        and missing values are None.
+        """
+        frame = self.df.copy()
+        for col in frame.select_dtypes(include='float').columns:
+            values = frame[col].dropna()
+            if len(values) and (values % 1 == 0).all():
+                try:
+                    frame[col] = frame[col].astype('Int64')
+                except (TypeError, ValueError, OverflowError):
+                    pass
         
-        return results
+        self._record_frame = frame.astype(object).where(frame.notna(), None)
+        # Row values as plain lists, so building result dicts needs no pandas dispatch
+        self._record_columns = self._record_frame.columns.tolist()
+        self._record_rows = self._record_frame.to_numpy().tolist()
+    
+    def _records_to_dicts(self, results_df: pd.DataFrame, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Convert matching rows (at most limit of them) to JSON-serializable dictionaries."""
+        columns = self._record_columns
+        rows = self._record_rows
+        positions = self.df.index.get_indexer(results_df.index[:limit])
+        return [dict(zip(columns, rows[position])) for position in positions]
     
     def _detect_name_columns(self) -> List[str]:
-        """Auto-detect columns that might contain names."""
-        # Based on the user's Excel structure
-        common_name_keywords = [
-            'nombre', 'name', 'apellido', 'surname', 'completo', 'full',
-            'primer', 'segundo', 'primer_nombre', 'segundo_nombre',
-            'razon social', 'razón social', 'representante legal'
-        ]
-        
-        detected = []
-        for col in self.df.columns:
-            col_lower = str(col).lower()
-            if any(keyword in col_lower for keyword in common_name_keywords):
-                detected.append(col)
-        
-        # If no matches, return first few text columns
-        if not detected:
-            text_cols = self.df.select_dtypes(include=['object']).columns.tolist()
-            detected = text_cols[:3] if len(text_cols) >= 3 else text_cols
-        
-        return detected if detected else [self.df.columns[0]]
+        """Auto-detect columns that might contain names (cached until the next load)."""
+        if self._name_columns is None:
+            detected = [col for col in self.df.columns if NAME_COLUMN_PATTERN.search(str(col).lower())]
+            
+            # If no matches, return first few text columns
+            if not detected:
+                text_cols = self.df.select_dtypes(include=['object']).columns.tolist()
+                detected = text_cols[:3] if len(text_cols) >= 3 else text_cols
+            
+            self._name_columns = detected if detected else [self.df.columns[0]]
+        
+        return list(self._name_columns)
     
     def _detect_id_columns(self) -> List[str]:
-        """Auto-detect columns that might contain IDs."""
-        # Based on the user's Excel structure
-        common_id_keywords = [
-            'id', 'cedula', 'cedula_ciudadania', 'cédula', 'documento', 'document', 
-            'numero', 'número', 'numero_documento', 'identificacion', 'identificación',
-            'dni', 'pasaporte', 'nit'
-        ]
-        
-        detected = []
-        for col in self.df.columns:
-            col_lower = str(col).lower()
-            if any(keyword in col_lower for keyword in common_id_keywords):
-                detected.append(col)
-        
-        return detected if detected else []
+        """Auto-detect columns that might contain IDs (cached until the next load)."""
+        if self._id_columns is None:
+            self._id_columns = [col for col in self.df.columns if ID_COLUMN_PATTERN.search(str(col).lower())]
+        
+        return list(self._id_columns)
     
     def get_all_columns(self) -> List[str]:
         """Get list of all column names in the Excel file."""
@@ -210,7 +466,7 @@ class ExcelSearch:
         Returns:
             List of unique suggestion strings
         """
-        if self.df is None or self.df.empty or len(search_term.strip()) < 2:
+        if self.df is None or self.df.empty or len(search_term.strip()) < MIN_SEARCH_LENGTH:
             return []
         
         # Auto-detect columns if not provided
@@ -227,9 +483,7 @@ class ExcelSearch:
         for col in name_columns:
             if col in self.df.columns:
                 # Get unique values that match
-                matches = self.df[col].astype(str).str.lower().str.contains(
-                    search_term_lower, na=False, regex=False
-                )
+                matches = self._column_contains(col, search_term_lower)
                 matched_values = self.df.loc[matches, col].dropna().unique()
                 
                 for value in matched_values:
@@ -251,9 +505,7 @@ class ExcelSearch:
         if len(suggestions) < limit:
             for col in id_columns:
                 if col in self.df.columns:
-                    matches = self.df[col].astype(str).str.lower().str.contains(
-                        search_term_lower, na=False, regex=False
-                    )
+                    matches = self._column_contains(col, search_term_lower)
                     matched_values = self.df.loc[matches, col].dropna().unique()
                     
                     for value in matched_values:
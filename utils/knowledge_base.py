@@ -4,31 +4,66 @@ Stores and processes the official ICETEX dependencies PDF for improved classific
 """
 
 import os
-import json
+import mmap
 import hashlib
-from typing import Optional, Dict, Any
+import logging
+import threading
+from typing import Optional, Dict, Any, BinaryIO
 from datetime import datetime
 from pathlib import Path
 
+import orjson
+
 from .pdf_extractor import PDFExtractor
 
+try:
+    # SIMD-accelerated; file hashes are only used for change detection
+    from blake3 import blake3 as _file_hasher
+except ImportError:
+    _file_hasher = hashlib.blake2b
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_stream(stream: BinaryIO) -> str:
+    """Hash a binary stream in chunks (memory use is bounded by the chunk size)."""
+    hasher = _file_hasher()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
 
 class ICETEXKnowledgeBase:
     """Manages the ICETEX dependencies reference document for enhanced classification."""
     
-    def __init__(self, storage_dir: str = "knowledge_base"):
+    def __init__(self, storage_dir: str = "knowledge_base", pdf_extractor: Optional[PDFExtractor] = None):
         """
         Initialize the knowledge base.
         
         Args:
             storage_dir: Directory to store knowledge base files
+            pdf_extractor: Extractor to share with the rest of the app (a new one is created if None)
         """
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(exist_ok=True)
         
         self.dependencies_file = self.storage_dir / "dependencies_info.json"
         self.reference_text_file = self.storage_dir / "reference_text.txt"
-        self.pdf_extractor = PDFExtractor()
+        self.pdf_extractor = pdf_extractor or PDFExtractor()
+        
+        # Truncated reference text per max_length (replaced whenever reference_text changes)
+        self._context_cache: Dict[int, str] = {}
+        
+        # The reference text is memory-mapped from reference_text_file rather than held as a str;
+        # version increases whenever it changes
+        self._reference_map: Optional[mmap.mmap] = None
+        self._reference_length = 0
+        self._reference_available = False
+        self.version = 0
+        # Serializes remapping; readers in worker threads use whichever mapping they picked up
+        self._map_lock = threading.Lock()
         
         # Load existing knowledge base
         self._load_knowledge_base()
@@ -36,35 +71,79 @@ class ICETEXKnowledgeBase:
     def _load_knowledge_base(self):
         """Load existing knowledge base data."""
         self.dependencies_info = {}
-        self.reference_text = ""
         
         if self.dependencies_file.exists():
             try:
-                with open(self.dependencies_file, 'r', encoding='utf-8') as f:
-                    self.dependencies_info = json.load(f)
+                self.dependencies_info = orjson.loads(self.dependencies_file.read_bytes())
             except Exception as e:
-                print(f"Warning: Could not load dependencies info: {e}")
+                logger.warning("Could not load dependencies info: %s", e)
         
-        if self.reference_text_file.exists():
+        self._map_reference_text()
+    
+    def _map_reference_text(self):
+        """
+        Memory-map the reference text file (replacing any previous mapping).
+        
+        The previous mapping is never closed here: get_reference_context() calls in
+        other threads may still be reading it, and it is released once they drop it.
+        """
+        with self._map_lock:
+            reference_map = None
+            length = 0
+            available = False
             try:
-                with open(self.reference_text_file, 'r', encoding='utf-8') as f:
-                    self.reference_text = f.read()
+                with open(self.reference_text_file, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size > 0:
+                        reference_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                
+                if reference_map is not None:
+                    # Decoded once to measure it; only the mapping is kept
+                    text = reference_map[:].decode('utf-8', errors='ignore')
+                    length = len(text)
+                    available = len(text.strip()) > 100
+            except FileNotFoundError:
+                pass
             except Exception as e:
-                print(f"Warning: Could not load reference text: {e}")
+                reference_map = None
+                logger.warning("Could not load reference text: %s", e)
+            
+            self._reference_map = reference_map
+            self._reference_length = length
+            self._reference_available = available
+            # Replaced (not cleared) after the new mapping is in place, so a reader still
+            # working from the old mapping can only write to the discarded cache
+            self._context_cache = {}
+            self.version += 1
     
-    def _save_knowledge_base(self):
-        """Save knowledge base data to files."""
+    @property
+    def reference_text(self) -> str:
+        """Full reference text (decoded from the mapped file on each access)."""
+        if self._reference_map is None:
+            return ""
+        return self._reference_map[:].decode('utf-8', errors='ignore')
+    
+    def _save_knowledge_base(self, reference_text: Optional[str] = None):
+        """
+        Save knowledge base data to files.
+        
+        Args:
+            reference_text: New reference text to write and map (None keeps the current one)
+        """
         try:
             # Save dependencies info
-            with open(self.dependencies_file, 'w', encoding='utf-8') as f:
-                json.dump(self.dependencies_info, f, indent=2, ensure_ascii=False)
+            self.dependencies_file.write_bytes(
+                orjson.dumps(self.dependencies_info, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            )
             
-            # Save reference text
-            with open(self.reference_text_file, 'w', encoding='utf-8') as f:
-                f.write(self.reference_text)
+            # Save reference text next to the old file and swap it in, so the current mapping stays valid
+            if reference_text is not None:
+                temp_file = self.reference_text_file.with_suffix('.tmp')
+                temp_file.write_text(reference_text, encoding='utf-8')
+                os.replace(temp_file, self.reference_text_file)
+                self._map_reference_text()
                 
         except Exception as e:
-            print(f"Error saving knowledge base: {e}")
+            logger.error("Error saving knowledge base: %s", e)
     
     def upload_dependencies_pdf(self, pdf_path: str, description: str = "") -> Dict[str, Any]:
         """
@@ -80,20 +159,20 @@ class ICETEXKnowledgeBase:
         try:
             # Calculate file hash for change detection
             with open(pdf_path, 'rb') as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()
+                file_hash = _hash_stream(f)
             
             # Check if this is the same file we already have
             if (self.dependencies_info.get('file_hash') == file_hash and 
-                self.reference_text):
+                self._reference_length):
                 return {
                     "success": True,
                     "message": "Document already uploaded and processed",
                     "file_hash": file_hash,
-                    "text_length": len(self.reference_text)
+                    "text_length": self._reference_length
                 }
             
             # Extract text from PDF
-            print(f"Processing dependencies PDF: {pdf_path}")
+            logger.info("Processing dependencies PDF: %s", pdf_path)
             extracted_text = self.pdf_extractor.extract_text(pdf_path)
             
             if not extracted_text or len(extracted_text.strip()) < 100:
@@ -103,7 +182,6 @@ class ICETEXKnowledgeBase:
                 }
             
             # Update knowledge base
-            self.reference_text = extracted_text
             self.dependencies_info = {
                 "file_hash": file_hash,
                 "filename": os.path.basename(pdf_path),
@@ -114,7 +192,7 @@ class ICETEXKnowledgeBase:
             }
             
             # Save to files
-            self._save_knowledge_base()
+            self._save_knowledge_base(extracted_text)
             
             return {
                 "success": True,
@@ -144,20 +222,20 @@ class ICETEXKnowledgeBase:
         """
         try:
             # Calculate file hash
-            file_hash = hashlib.md5(pdf_bytes).hexdigest()
+            file_hash = _file_hasher(pdf_bytes).hexdigest()
             
             # Check if this is the same file we already have
             if (self.dependencies_info.get('file_hash') == file_hash and 
-                self.reference_text):
+                self._reference_length):
                 return {
                     "success": True,
                     "message": "Document already uploaded and processed",
                     "file_hash": file_hash,
-                    "text_length": len(self.reference_text)
+                    "text_length": self._reference_length
                 }
             
             # Extract text from PDF bytes
-            print(f"Processing dependencies PDF: {filename}")
+            logger.info("Processing dependencies PDF: %s", filename)
             extracted_text = self.pdf_extractor.extract_from_bytes(pdf_bytes)
             
             if not extracted_text or len(extracted_text.strip()) < 100:
@@ -167,7 +245,6 @@ class ICETEXKnowledgeBase:
                 }
             
             # Update knowledge base
-            self.reference_text = extracted_text
             self.dependencies_info = {
                 "file_hash": file_hash,
                 "filename": filename,
@@ -178,7 +255,71 @@ class ICETEXKnowledgeBase:
             }
             
             # Save to files
-            self._save_knowledge_base()
+            self._save_knowledge_base(extracted_text)
+            
+            return {
+                "success": True,
+                "message": "Dependencies document uploaded and processed successfully",
+                "file_hash": file_hash,
+                "text_length": len(extracted_text),
+                "filename": filename
+            }
+            
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Error processing PDF: {str(e)}"
+            }
+    
+    def upload_dependencies_from_stream(self, pdf_stream: BinaryIO, filename: str, description: str = "") -> Dict[str, Any]:
+        """
+        Upload and process dependencies PDF from a binary stream (for streamed uploads).
+        
+        Args:
+            pdf_stream: Readable, seekable binary stream positioned at the start of the PDF
+            filename: Original filename
+            description: Optional description
+            
+        Returns:
+            Dictionary with upload results
+        """
+        try:
+            # Calculate file hash in chunks
+            file_hash = _hash_stream(pdf_stream)
+            pdf_stream.seek(0)
+            
+            # Check if this is the same file we already have
+            if (self.dependencies_info.get('file_hash') == file_hash and 
+                self._reference_length):
+                return {
+                    "success": True,
+                    "message": "Document already uploaded and processed",
+                    "file_hash": file_hash,
+                    "text_length": self._reference_length
+                }
+            
+            # Extract text from PDF stream
+            logger.info("Processing dependencies PDF: %s", filename)
+            extracted_text = self.pdf_extractor.extract_from_stream(pdf_stream)
+            
+            if not extracted_text or len(extracted_text.strip()) < 100:
+                return {
+                    "success": False,
+                    "error": "Could not extract sufficient text from the PDF"
+                }
+            
+            # Update knowledge base
+            self.dependencies_info = {
+                "file_hash": file_hash,
+                "filename": filename,
+                "upload_date": datetime.now().isoformat(),
+                "description": description,
+                "text_length": len(extracted_text),
+                "last_processed": datetime.now().isoformat()
+            }
+            
+            # Save to files
+            self._save_knowledge_base(extracted_text)
             
             return {
                 "success": True,
@@ -204,26 +345,36 @@ class ICETEXKnowledgeBase:
         Returns:
             Reference text for use in classification
         """
-        if not self.reference_text:
+        context_cache = self._context_cache
+        reference_map = self._reference_map
+        if reference_map is None:
             return ""
         
+        context = context_cache.get(max_length)
+        if context is not None:
+            return context
+        
+        # Only the bytes that can hold max_length characters (UTF-8: at most 4 bytes each) are decoded
+        context = reference_map[:max_length * 4].decode('utf-8', errors='ignore')
+        
         # If text is too long, truncate intelligently
-        if len(self.reference_text) > max_length:
+        if self._reference_length > max_length:
             # Try to find a good truncation point
-            truncated = self.reference_text[:max_length]
+            truncated = context[:max_length]
             last_period = truncated.rfind('.')
             if last_period > max_length * 0.8:  # If we can find a period in the last 20%
-                return truncated[:last_period + 1]
+                context = truncated[:last_period + 1]
             else:
-                return truncated + "..."
+                context = truncated + "..."
         
-        return self.reference_text
+        context_cache[max_length] = context
+        return context
     
     def get_knowledge_base_info(self) -> Dict[str, Any]:
         """Get information about the current knowledge base."""
         return {
-            "has_reference_document": bool(self.reference_text),
-            "reference_text_length": len(self.reference_text) if self.reference_text else 0,
+            "has_reference_document": bool(self._reference_length),
+            "reference_text_length": self._reference_length,
             "dependencies_info": self.dependencies_info,
             "last_updated": self.dependencies_info.get('upload_date', 'Never')
         }
@@ -231,7 +382,7 @@ class ICETEXKnowledgeBase:
     def clear_knowledge_base(self) -> Dict[str, Any]:
         """Clear the knowledge base."""
         try:
-            # Remove files
+            # Remove files (the current mapping stays readable until its readers finish)
             if self.dependencies_file.exists():
                 self.dependencies_file.unlink()
             if self.reference_text_file.exists():
@@ -239,7 +390,7 @@ class ICETEXKnowledgeBase:
             
             # Clear memory
             self.dependencies_info = {}
-            self.reference_text = ""
+            self._map_reference_text()
             
             return {
                 "success": True,
@@ -254,4 +405,4 @@ class ICETEXKnowledgeBase:
     
     def is_available(self) -> bool:
         """Check if the knowledge base has reference material."""
-        return bool(self.reference_text and len(self.reference_text.strip()) > 100)
+        return self._reference_available
@@ -0,0 +1,46 @@
+"""
+Logging setup for the ICETEX petition classification system.
+Log records are handed to a queue and written by a background thread,
+so request handlers never block on console I/O.
+"""
+
+import os
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: Optional[str] = None) -> QueueListener:
+    """
+    Route the root logger through a QueueHandler drained by a QueueListener thread.
+
+    Safe to call more than once; only the first call installs the handlers.
+
+    Args:
+        level: Log level name (default: LOG_LEVEL env var or INFO)
+
+    Returns:
+        The running QueueListener
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
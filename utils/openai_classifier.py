@@ -1,21 +1,98 @@
 """
 OpenAI API integration for ICETEX petition classification.
-Uses GPT-4 to classify petitions into the appropriate ICETEX dependency.
+Classifies petitions into the appropriate ICETEX dependency with gpt-4o-mini by default,
+retrying low-confidence results on a larger escalation model (gpt-4o).
 """
 
 import os
+import io
 import json
+import hashlib
+import functools
+import time
+import asyncio
 import re
-from typing import Dict, Any, List
+import random
+import logging
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
 from dotenv import load_dotenv
 
+from .text_prep import condense
+
+try:
+    # Optional: typed C decoder for model responses (falls back to json + field checks)
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    # Optional: exact local token counts (falls back to the 4-characters-per-token estimate)
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 # Import OpenAI - force legacy API to avoid compatibility issues
 import openai
+from openai.api_requestor import APIRequestor
+from openai.error import RateLimitError, ServiceUnavailableError, APIConnectionError
 OPENAI_NEW_API = False
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+if msgspec is not None:
+    class Classification(msgspec.Struct):
+        """Fields of a classification response; defaults stand in for missing ones."""
+        dependencia: str = "N/A"
+        confianza: str = "N/A"
+        motivo: str = "N/A"
+        palabras_clave: List[str] = []
+    
+    _classification_decoder = msgspec.json.Decoder(Classification)
+    JSON_DECODE_ERRORS = (json.JSONDecodeError, msgspec.DecodeError)
+else:
+    _classification_decoder = None
+    JSON_DECODE_ERRORS = (json.JSONDecodeError,)
+
+
+# Outermost {...} of a response that wraps its JSON in markdown fences or prose
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _decode_json_response(decode, text: str):
+    """
+    Decode a model response, retrying on the embedded JSON object if the whole text is not valid JSON.
+    
+    Args:
+        decode: Decoder to apply (e.g. json.loads)
+        text: Content of the chat completion
+    """
+    try:
+        return decode(text)
+    except JSON_DECODE_ERRORS:
+        match = _JSON_OBJECT.search(text)
+        if match is None or len(match.group()) == len(text):
+            raise
+        return decode(match.group())
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Return the tiktoken encoding for a model, or None when tiktoken or its BPE file is unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # The BPE file is downloaded on first use; offline hosts fall back to the estimate
+        logger.warning("Could not load tiktoken encoding for %s, estimating token counts: %s", model, e)
+        return None
+
 
 class ICETEXClassifier:
     """Classifies ICETEX petitions using OpenAI API."""
@@ -57,13 +134,48 @@ Salida:
 
 IMPORTANTE: TODAS las respuestas deben estar en español. El campo "motivo" debe explicar en español por qué se asignó esta dependencia."""
     
+    BATCH_PROMPT = """
+
+### CLASIFICACIÓN POR LOTES
+Recibirás varias peticiones numeradas como [1], [2], ... Clasifica cada una de forma independiente y devuelve un único objeto JSON con este formato:
+{
+  "clasificaciones": [
+    {"indice": 1, "dependencia": "", "confianza": "", "motivo": "", "palabras_clave": []}
+  ]
+}
+Incluye exactamente un elemento por petición, con su número en "indice"."""
+    
+    # Maximum petitions packed into one classify_many() request
+    PACK_SIZE = 8
+    
+    # JSON mode: the model always returns a syntactically valid JSON object
+    RESPONSE_FORMAT = {"type": "json_object"}
+    
+    # Petitions longer than this are condensed before classification
+    CONDENSE_MAX_CHARS = 8000
+    
+    # Token budget for a petition sent without condensing; longer ones keep only head + tail
+    MAX_PETITION_TOKENS = 25000
+    TRUNCATE_HEAD_TOKENS = 18000
+    TRUNCATE_TAIL_TOKENS = 5000
+    
+    # Batch API: requests are billed at half price and answered within the completion window
+    BATCH_ENDPOINT = "/v1/chat/completions"
+    BATCH_COMPLETION_WINDOW = "24h"
+    BATCH_PENDING_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+    
+    # Transient failures retried with exponential backoff (or the server's retry-after)
+    RETRYABLE_ERRORS = (RateLimitError, ServiceUnavailableError, APIConnectionError)
+    RETRY_BASE_DELAY = 1.0
+    RETRY_MAX_DELAY = 60.0
+    
     def __init__(self, api_key: str = None, model: str = None, knowledge_base=None):
         """
         Initialize the classifier.
         
         Args:
             api_key: OpenAI API key (if None, reads from OPENAI_API_KEY env var)
-            model: Model to use (default: gpt-4-turbo)
+            model: Model to use (default: gpt-4o-mini)
             knowledge_base: ICETEXKnowledgeBase instance for reference document
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
@@ -73,13 +185,33 @@ IMPORTANTE: TODAS las respuestas deben estar en español. El campo "motivo" debe
                 "or pass it to the constructor."
             )
         
-        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4-turbo")
+        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        # Single petitions classified with low confidence are retried on this larger model
+        # (set OPENAI_ESCALATION_MODEL empty to disable)
+        self.escalation_model = os.getenv("OPENAI_ESCALATION_MODEL", "gpt-4o")
+        self.escalation_confidence = float(os.getenv("OPENAI_ESCALATION_CONFIDENCE", "70"))
+        if self.escalation_model and self.escalation_model == self.model:
+            logger.info("OPENAI_ESCALATION_MODEL equals OPENAI_MODEL (%s); low-confidence escalation is disabled", self.model)
+        # Classifications whose confianza had no number (never escalated)
+        self.missing_confidence = 0
+        self.embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
         self.knowledge_base = knowledge_base
+        # Maximum concurrent requests for aclassify_many()
+        self.concurrency = int(os.getenv("OPENAI_CONCURRENCY", "16"))
+        # Retries per chat completion on rate limits and transient errors
+        self.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+        self._system_prompt_cache = None
+        self._cache_namespace = None
+        # Token encoding for petition budgets, loaded (and possibly downloaded) once here
+        self._encoding = _get_encoding(self.model)
+        # Prompt tokens sent and how many of them OpenAI served from its prompt cache
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
         
         # Initialize OpenAI client - use legacy API only
         openai.api_key = self.api_key
         self.client = openai
-        print("✅ OpenAI client initialized successfully (legacy API)")
+        logger.info("OpenAI client initialized successfully (legacy API)")
     
     def classify(self, petition_text: str) -> Dict[str, Any]:
         """
@@ -95,157 +227,616 @@ IMPORTANTE: TODAS las respuestas deben estar en español. El campo "motivo" debe
             - motivo: Explanation for the classification
             - palabras_clave: Keywords detected in the text
         """
+        return self._classify_with_model(petition_text)[0]
+    
+    def _classify_with_model(self, petition_text: str) -> Tuple[Dict[str, Any], str]:
+        """classify(), also returning the model that produced the result (the escalation model when retried)."""
         if not petition_text or len(petition_text.strip()) < 10:
-            return {
-                "dependencia": "Error",
-                "confianza": "0%",
-                "motivo": "The petition text is too short or empty to classify.",
-                "palabras_clave": []
-            }
+            return self._error_result("The petition text is too short or empty to classify."), self.model
+        
+        try:
+            petition_text = self._truncate_to_budget(petition_text)
+            
+            result = self._request_classification(petition_text, self.model)
+            if self._should_escalate(result):
+                logger.info("Low confidence (%s) on %s, escalating to %s", result.get("confianza"), self.model, self.escalation_model)
+                return self._request_classification(petition_text, self.escalation_model), self.escalation_model
+            return result, self.model
+            
+        except JSON_DECODE_ERRORS as e:
+            return self._error_result(f"Failed to parse OpenAI response as JSON: {str(e)}"), self.model
+        except Exception as e:
+            return self._error_result(f"Classification error: {str(e)}"), self.model
+    
+    async def aclassify(self, petition_text: str) -> Dict[str, Any]:
+        """
+        Async version of classify(); the request is awaited instead of holding a worker thread.
+        
+        Args:
+            petition_text: The extracted text from the petition PDF
+            
+        Returns:
+            Dictionary with the same classification fields as classify()
+        """
+        return (await self._aclassify_with_model(petition_text))[0]
+    
+    async def _aclassify_with_model(self, petition_text: str) -> Tuple[Dict[str, Any], str]:
+        """Async version of _classify_with_model()."""
+        if not petition_text or len(petition_text.strip()) < 10:
+            return self._error_result("The petition text is too short or empty to classify."), self.model
         
         try:
-            # Check if text is too large (rough estimate: 1 token ≈ 4 characters)
-            estimated_tokens = len(petition_text) // 4
-            if estimated_tokens > 25000:  # Leave room for system prompt and response
-                print(f"Text too large ({estimated_tokens} estimated tokens). Summarizing...")
-                petition_text = self._summarize_large_text(petition_text)
-            
-            # Build enhanced system prompt with knowledge base context
-            system_prompt = self.SYSTEM_PROMPT
-            
-            # Add knowledge base context if available
-            if self.knowledge_base and self.knowledge_base.is_available():
-                reference_context = self.knowledge_base.get_reference_context()
-                if reference_context:
-                    system_prompt += f"\n\n### DOCUMENTO DE REFERENCIA ADICIONAL\nTienes acceso al documento oficial de dependencias de ICETEX con información detallada:\n\n{reference_context}\n\nUsa esta información detallada para hacer clasificaciones más precisas. Todas las respuestas deben estar en español."
-            
-            # Call OpenAI API using legacy API
-            response = self.client.ChatCompletion.create(
+            petition_text = self._truncate_to_budget(petition_text)
+            
+            result = await self._arequest_classification(petition_text, self.model)
+            if self._should_escalate(result):
+                logger.info("Low confidence (%s) on %s, escalating to %s", result.get("confianza"), self.model, self.escalation_model)
+                return await self._arequest_classification(petition_text, self.escalation_model), self.escalation_model
+            return result, self.model
+            
+        except JSON_DECODE_ERRORS as e:
+            return self._error_result(f"Failed to parse OpenAI response as JSON: {str(e)}"), self.model
+        except Exception as e:
+            return self._error_result(f"Classification error: {str(e)}"), self.model
+    
+    async def aclassify_many(self, petition_texts: List[str], concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Classify several petitions with concurrent requests (one per petition).
+        
+        Unlike classify_many(), every petition gets its own chat completion, so
+        nothing is truncated to share a context window; the round trips overlap
+        instead of running one after another.
+        
+        Args:
+            petition_texts: Extracted texts, one per petition
+            concurrency: Maximum requests in flight (default: self.concurrency)
+            
+        Returns:
+            One classification dictionary per petition, in input order
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        
+        async def bounded(petition_text: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.aclassify(condense(petition_text, max_chars=self.CONDENSE_MAX_CHARS))
+        
+        return list(await asyncio.gather(*[bounded(text) for text in petition_texts]))
+    
+    # Picks the dependency out of a partial JSON response while it is being streamed
+    DEPENDENCIA_PATTERN = re.compile(r'"dependencia"\s*:\s*"((?:[^"\\]|\\.)*)"')
+    
+    async def classify_stream(self, petition_text: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Classify a petition, yielding events while OpenAI streams the response.
+        
+        Events (in order):
+        - {"type": "delta", "content": ...}: each fragment of the model output
+        - {"type": "dependencia", "dependencia": ...}: as soon as that field is complete
+        - {"type": "result", "classification": ...}: the parsed classification (always last)
+        
+        Args:
+            petition_text: The extracted text from the petition PDF
+            
+        Yields:
+            Event dictionaries
+        """
+        if not petition_text or len(petition_text.strip()) < 10:
+            yield {"type": "result", "classification": self._error_result("The petition text is too short or empty to classify.")}
+            return
+        
+        petition_text = condense(petition_text, max_chars=self.CONDENSE_MAX_CHARS)
+        
+        result_text = ""
+        dependencia_sent = False
+        try:
+            response = await self._acreate_completion(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Classify this petition:\n\n{petition_text}"}
-                ],
-                temperature=0.3
+                messages=self._build_messages(petition_text),
+                temperature=0.3,
+                response_format=self.RESPONSE_FORMAT,
+                stream=True
             )
-            result_text = response.choices[0].message.content
+            async for chunk in response:
+                content = chunk["choices"][0]["delta"].get("content")
+                if not content:
+                    continue
+                result_text += content
+                yield {"type": "delta", "content": content}
+                
+                if not dependencia_sent:
+                    match = self.DEPENDENCIA_PATTERN.search(result_text)
+                    if match:
+                        dependencia_sent = True
+                        yield {"type": "dependencia", "dependencia": json.loads(f'"{match.group(1)}"')}
             
-            result = json.loads(result_text)
+            classification = self._parse_classification(result_text)
             
-            # Validate required fields
-            required_fields = ["dependencia", "confianza", "motivo", "palabras_clave"]
-            for field in required_fields:
-                if field not in result:
-                    result[field] = "N/A" if field != "palabras_clave" else []
+        except JSON_DECODE_ERRORS as e:
+            classification = self._error_result(f"Failed to parse OpenAI response as JSON: {str(e)}")
+        except Exception as e:
+            classification = self._error_result(f"Classification error: {str(e)}")
+        
+        yield {"type": "result", "classification": classification}
+    
+    def classify_many(
+        self,
+        petition_texts: List[str],
+        max_total_chars: int = 100000,
+        pack_size: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Classify several petitions with a single chat completion per pack.
+        
+        The petitions are sent as an indexed list in one user message, so the
+        system prompt (and knowledge base context) is paid for once per pack.
+        
+        Args:
+            petition_texts: Extracted petition texts
+            max_total_chars: Character budget shared by all petitions in one request
+            pack_size: Maximum petitions per request (default: PACK_SIZE)
             
-            return result
+        Returns:
+            One classification dictionary per petition, in input order
+        """
+        pack_size = pack_size or self.PACK_SIZE
+        if len(petition_texts) > pack_size:
+            # Larger packs degrade accuracy and risk truncated responses, so split them
+            results = []
+            for start in range(0, len(petition_texts), pack_size):
+                results.extend(self.classify_many(petition_texts[start:start + pack_size], max_total_chars, pack_size))
+            return results
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(petition_texts)
+        pending = []
+        for i, text in enumerate(petition_texts):
+            if not text or len(text.strip()) < 10:
+                results[i] = self._error_result("The petition text is too short or empty to classify.")
+            else:
+                pending.append(i)
+        
+        if len(pending) == 1:
+            results[pending[0]] = self.classify(condense(petition_texts[pending[0]], max_chars=self.CONDENSE_MAX_CHARS))
+        elif pending:
+            per_petition_chars = max_total_chars // len(pending)
+            sections = []
+            for number, i in enumerate(pending, 1):
+                text = condense(petition_texts[i], max_chars=min(self.CONDENSE_MAX_CHARS, per_petition_chars))
+                if len(text) > per_petition_chars:
+                    text = text[:per_petition_chars] + "\n\n[Texto truncado por límite de tokens]"
+                sections.append(f"[{number}]\n{text}")
             
-        except json.JSONDecodeError as e:
-            return {
-                "dependencia": "Error",
-                "confianza": "0%",
-                "motivo": f"Failed to parse OpenAI response as JSON: {str(e)}",
-                "palabras_clave": []
-            }
-        except Exception as e:
-            return {
-                "dependencia": "Error",
-                "confianza": "0%",
-                "motivo": f"Classification error: {str(e)}",
-                "palabras_clave": []
+            try:
+                response = self._create_completion(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": self._build_system_prompt() + self.BATCH_PROMPT},
+                        {"role": "user", "content": f"Classify these {len(pending)} petitions:\n\n" + "\n\n".join(sections)}
+                    ],
+                    temperature=0.3,
+                    response_format=self.RESPONSE_FORMAT
+                )
+                self._record_usage(response)
+                items = _decode_json_response(json.loads, response.choices[0].message.content).get("clasificaciones", [])
+                by_number = {}
+                for item in items:
+                    if isinstance(item, dict):
+                        number = self._parse_index(item.get("indice"))
+                        if number is not None:
+                            by_number.setdefault(number, item)
+                
+                for number, i in enumerate(pending, 1):
+                    item = by_number.get(number)
+                    if item is None:
+                        results[i] = self._error_result("The batch response did not include this petition.")
+                    else:
+                        item.pop("indice", None)
+                        results[i] = self._ensure_fields(item)
+                        
+            except json.JSONDecodeError as e:
+                for i in pending:
+                    results[i] = self._error_result(f"Failed to parse OpenAI response as JSON: {str(e)}")
+            except Exception as e:
+                for i in pending:
+                    results[i] = self._error_result(f"Classification error: {str(e)}")
+        
+        return results
+    
+    def submit_batch(self, petition_texts: List[str]) -> str:
+        """
+        Submit petitions to the OpenAI Batch API for offline classification.
+        
+        Each petition becomes one request with the same static-first messages
+        as classify(), so batch pricing and prompt caching both apply.
+        
+        Args:
+            petition_texts: Extracted petition texts (request i gets custom_id "pet-i")
+            
+        Returns:
+            ID of the created batch, for fetch_batch_results()
+        """
+        lines = []
+        for i, text in enumerate(petition_texts):
+            body = {
+                "model": self.model,
+                "messages": self._build_messages(condense(text, max_chars=self.CONDENSE_MAX_CHARS)),
+                "temperature": 0.3,
+                "response_format": self.RESPONSE_FORMAT
             }
+            lines.append(json.dumps(
+                {"custom_id": f"pet-{i}", "method": "POST", "url": self.BATCH_ENDPOINT, "body": body},
+                ensure_ascii=False
+            ))
+        
+        upload = self.client.File.create(
+            file=io.BytesIO("\n".join(lines).encode("utf-8")),
+            purpose="batch",
+            user_provided_filename="petitions.jsonl"
+        )
+        batch = self._api_request("post", "/batches", {
+            "input_file_id": upload["id"],
+            "endpoint": self.BATCH_ENDPOINT,
+            "completion_window": self.BATCH_COMPLETION_WINDOW
+        })
+        logger.info("Submitted batch %s with %d petitions", batch["id"], len(lines))
+        return batch["id"]
+    
+    def fetch_batch_results(self, batch_id: str, count: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Collect the classifications of a submitted batch.
+        
+        Args:
+            batch_id: ID returned by submit_batch()
+            count: Number of petitions submitted in the batch
+            
+        Returns:
+            One classification dictionary per petition (in submission order),
+            or None while the batch is still running
+        """
+        batch = self._api_request("get", f"/batches/{batch_id}")
+        status = batch.get("status")
+        if status in self.BATCH_PENDING_STATUSES:
+            return None
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * count
+        if batch.get("output_file_id"):
+            output = self.client.File.download(batch["output_file_id"]).decode("utf-8")
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                i = int(item["custom_id"].split("-", 1)[1])
+                response = item.get("response") or {}
+                try:
+                    if response.get("status_code") != 200:
+                        raise ValueError(f"request failed with status {response.get('status_code')}")
+                    self._record_usage(response["body"])
+                    results[i] = self._parse_classification(response["body"]["choices"][0]["message"]["content"])
+                except JSON_DECODE_ERRORS as e:
+                    results[i] = self._error_result(f"Failed to parse OpenAI response as JSON: {str(e)}")
+                except Exception as e:
+                    results[i] = self._error_result(f"Classification error: {str(e)}")
+        
+        return [
+            result if result is not None else self._error_result(f"The batch finished with status '{status}' without this petition.")
+            for result in results
+        ]
+    
+    def classify_batch(
+        self,
+        petition_texts: List[str],
+        poll_interval: float = 30.0,
+        timeout: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Classify petitions through the Batch API, waiting for the batch to finish.
+        
+        Meant for bulk offline ingestion: it costs half as much as classify(),
+        but results can take up to the 24h completion window.
+        
+        Args:
+            petition_texts: Extracted petition texts
+            poll_interval: Seconds between status checks
+            timeout: Maximum seconds to wait (None waits for the completion window)
+            
+        Returns:
+            One classification dictionary per petition, in input order
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(petition_texts)
+        pending = []
+        for i, text in enumerate(petition_texts):
+            if not text or len(text.strip()) < 10:
+                results[i] = self._error_result("The petition text is too short or empty to classify.")
+            else:
+                pending.append(i)
+        
+        if pending:
+            try:
+                batch_id = self.submit_batch([petition_texts[i] for i in pending])
+                deadline = time.monotonic() + timeout if timeout is not None else None
+                batch_results = self.fetch_batch_results(batch_id, len(pending))
+                while batch_results is None:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TimeoutError(f"batch {batch_id} did not finish within {timeout} seconds")
+                    time.sleep(poll_interval)
+                    batch_results = self.fetch_batch_results(batch_id, len(pending))
+                
+                for i, result in zip(pending, batch_results):
+                    results[i] = result
+                    
+            except Exception as e:
+                for i in pending:
+                    results[i] = self._error_result(f"Classification error: {str(e)}")
+        
+        return results
     
-    def classify_with_metadata(self, petition_text: str) -> Dict[str, Any]:
+    def classify_with_metadata(self, petition_text: str, classification: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Classify a petition and return additional metadata.
         
+        Args:
+            petition_text: The extracted text from the petition PDF
+            classification: Previously computed (e.g. cached) classification; skips the API call
+        
         Returns:
             Dictionary with classification and metadata (tokens used, model, etc.)
         """
-        result = self.classify(petition_text)
+        if classification is not None:
+            result, model = classification, self.model
+        else:
+            # Long petitions are condensed (header, closing, keyword sentences) to save input tokens
+            result, model = self._classify_with_model(condense(petition_text, max_chars=self.CONDENSE_MAX_CHARS))
+        
+        return self._with_metadata(petition_text, result, model)
+    
+    async def aclassify_with_metadata(self, petition_text: str, classification: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Async version of classify_with_metadata()."""
+        if classification is not None:
+            result, model = classification, self.model
+        else:
+            result, model = await self._aclassify_with_model(condense(petition_text, max_chars=self.CONDENSE_MAX_CHARS))
         
+        return self._with_metadata(petition_text, result, model)
+    
+    def _with_metadata(self, petition_text: str, result: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """Wrap a classification with the model that produced it and petition text metadata."""
         return {
             "classification": result,
             "metadata": {
-                "model": self.model,
+                "model": model,
                 "text_length": len(petition_text),
                 "text_preview": petition_text[:200] + "..." if len(petition_text) > 200 else petition_text
             }
         }
     
-    def _summarize_large_text(self, text: str) -> str:
-        """Summarize large text to fit within token limits."""
-        try:
-            # Split text into chunks
-            chunks = self._split_text_into_chunks(text, max_chunk_size=15000)
-            
-            if len(chunks) == 1:
-                # Single chunk, summarize directly
-                return self._summarize_chunk(chunks[0])
-            
-            # Multiple chunks, summarize each and combine
-            summarized_chunks = []
-            for i, chunk in enumerate(chunks):
-                print(f"Summarizing chunk {i+1}/{len(chunks)}...")
-                summarized_chunk = self._summarize_chunk(chunk)
-                summarized_chunks.append(summarized_chunk)
-            
-            # Combine summarized chunks
-            combined_summary = "\n\n".join(summarized_chunks)
-            
-            # If still too large, summarize the combined summary
-            if len(combined_summary) > 20000:
-                return self._summarize_chunk(combined_summary)
-            
-            return combined_summary
+    def embed(self, text: str, max_chars: int = 8000) -> Optional[List[float]]:
+        """
+        Compute an embedding vector for a petition (used for near-duplicate cache lookups).
+        
+        Args:
+            text: Petition text
+            max_chars: Only the first max_chars characters are embedded
             
+        Returns:
+            Embedding vector, or None if the embedding request failed
+        """
+        try:
+            response = self.client.Embedding.create(
+                model=self.embedding_model,
+                input=text[:max_chars]
+            )
+            return response["data"][0]["embedding"]
         except Exception as e:
-            print(f"Error summarizing text: {e}")
-            # Fallback: return first part of text
-            return text[:20000] + "\n\n[Texto truncado por límite de tokens]"
+            logger.warning("Error computing embedding: %s", e)
+            return None
+    
+    @property
+    def cache_namespace(self) -> str:
+        """Fingerprint of the model and system prompt, used to scope cached classifications."""
+        system_prompt = self._build_system_prompt()
+        if self._cache_namespace is None or self._cache_namespace[0] is not system_prompt:
+            digest = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+            self._cache_namespace = (system_prompt, f"{self.model}|{digest}")
+        return self._cache_namespace[1]
     
-    def _split_text_into_chunks(self, text: str, max_chunk_size: int = 15000) -> List[str]:
-        """Split text into chunks of approximately max_chunk_size characters."""
-        chunks = []
-        current_chunk = ""
+    def _build_messages(self, petition_text: str) -> List[Dict[str, str]]:
+        """Chat messages for classifying a single petition."""
+        return [
+            {"role": "system", "content": self._build_system_prompt()},
+            {"role": "user", "content": f"Classify this petition:\n\n{petition_text}"}
+        ]
+    
+    def _build_system_prompt(self) -> str:
+        """
+        Build the system prompt, including the knowledge base context when available.
         
-        # Split by paragraphs first
-        paragraphs = text.split('\n\n')
+        The prompt is memoized per reference document: it must stay byte-identical
+        between calls so OpenAI's automatic prompt caching can reuse the prefix.
+        """
+        cache_key = None
+        if self.knowledge_base:
+            cache_key = (self.knowledge_base.dependencies_info.get('file_hash'), self.knowledge_base.version)
+        if self._system_prompt_cache is not None and self._system_prompt_cache[0] == cache_key:
+            return self._system_prompt_cache[1]
         
-        for paragraph in paragraphs:
-            if len(current_chunk) + len(paragraph) <= max_chunk_size:
-                current_chunk += paragraph + '\n\n'
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = paragraph + '\n\n'
+        system_prompt = self.SYSTEM_PROMPT
         
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        # Add knowledge base context if available
+        if self.knowledge_base and self.knowledge_base.is_available():
+            reference_context = self.knowledge_base.get_reference_context()
+            if reference_context:
+                system_prompt += f"\n\n### DOCUMENTO DE REFERENCIA ADICIONAL\nTienes acceso al documento oficial de dependencias de ICETEX con información detallada:\n\n{reference_context}\n\nUsa esta información detallada para hacer clasificaciones más precisas. Todas las respuestas deben estar en español."
         
-        return chunks
+        self._system_prompt_cache = (cache_key, system_prompt)
+        return system_prompt
+    
+    def _request_classification(self, petition_text: str, model: str) -> Dict[str, Any]:
+        """Classify one petition with the given model (JSON mode)."""
+        response = self._create_completion(
+            model=model,
+            messages=self._build_messages(petition_text),
+            temperature=0.3,
+            response_format=self.RESPONSE_FORMAT
+        )
+        self._record_usage(response)
+        return self._parse_classification(response.choices[0].message.content)
+    
+    async def _arequest_classification(self, petition_text: str, model: str) -> Dict[str, Any]:
+        """Async version of _request_classification()."""
+        response = await self._acreate_completion(
+            model=model,
+            messages=self._build_messages(petition_text),
+            temperature=0.3,
+            response_format=self.RESPONSE_FORMAT
+        )
+        self._record_usage(response)
+        return self._parse_classification(response.choices[0].message.content)
+    
+    def _should_escalate(self, result: Dict[str, Any]) -> bool:
+        """Whether a classification is confident enough to keep, or should be retried on the escalation model."""
+        if not self.escalation_model or self.escalation_model == self.model:
+            return False
+        match = re.search(r"\d+(?:[.,]\d+)?", str(result.get("confianza", "")))
+        if match is None:
+            # A malformed field is not evidence of low confidence: keep the result
+            self.missing_confidence += 1
+            logger.warning("Classification without a numeric confianza (%r); not escalating", result.get("confianza"))
+            return False
+        return float(match.group().replace(",", ".")) < self.escalation_confidence
+    
+    def _create_completion(self, **kwargs):
+        """ChatCompletion.create, retried on rate limits and transient errors."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.ChatCompletion.create(**kwargs)
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                logger.warning("OpenAI request failed (%s), retrying in %.1fs", type(e).__name__, delay)
+                time.sleep(delay)
     
-    def _summarize_chunk(self, chunk: str) -> str:
-        """Summarize a single chunk of text."""
+    async def _acreate_completion(self, **kwargs):
+        """ChatCompletion.acreate, retried on rate limits and transient errors."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.client.ChatCompletion.acreate(**kwargs)
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                logger.warning("OpenAI request failed (%s), retrying in %.1fs", type(e).__name__, delay)
+                await asyncio.sleep(delay)
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Seconds to wait before retrying a failed request.
+        
+        Uses the server's retry-after header when present, otherwise
+        exponential backoff with full jitter.
+        
+        Args:
+            error: The retryable OpenAI error
+            attempt: Number of retries already made (0 for the first)
+        """
+        headers = getattr(error, "headers", None) or {}
         try:
-            summary_prompt = """Resume el siguiente texto de una petición a ICETEX, manteniendo solo la información esencial para clasificar la dependencia apropiada. 
-            Incluye: tipo de solicitud, motivo principal, datos del solicitante, y cualquier detalle relevante para la clasificación.
-            Mantén el resumen en español y conciso pero completo."""
-            
-            response = self.client.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": summary_prompt},
-                    {"role": "user", "content": f"Resume esta petición:\n\n{chunk}"}
-                ],
-                temperature=0.3,
-                max_tokens=2000
-            )
-            
-            return response.choices[0].message.content.strip()
+            if headers.get("retry-after-ms"):
+                return min(float(headers["retry-after-ms"]) / 1000, self.RETRY_MAX_DELAY)
+            if headers.get("retry-after"):
+                return min(float(headers["retry-after"]), self.RETRY_MAX_DELAY)
+        except (TypeError, ValueError):
+            pass
+        return random.uniform(0, min(self.RETRY_BASE_DELAY * 2 ** attempt, self.RETRY_MAX_DELAY))
+    
+    def _api_request(self, method: str, url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Call an OpenAI REST endpoint the legacy SDK has no resource class for (e.g. /batches)."""
+        response, _, _ = APIRequestor(key=self.api_key).request(method, url, params)
+        return response.data
+    
+    def _record_usage(self, response):
+        """Add a completion's prompt token usage (including cached tokens) to the running totals."""
+        usage = response.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        self.prompt_tokens += prompt_tokens
+        self.cached_prompt_tokens += cached_tokens
+        logger.debug("Prompt tokens: %d (%d from prompt cache)", prompt_tokens, cached_tokens)
+    
+    def _parse_classification(self, result_text: str) -> Dict[str, Any]:
+        """
+        Decode a model response into a classification with every required field.
+        
+        Args:
+            result_text: JSON content of the chat completion
             
-        except Exception as e:
-            print(f"Error summarizing chunk: {e}")
-            # Fallback: return first part of chunk
-            return chunk[:1000] + "..."
-
+        Returns:
+            Classification dictionary
+        """
+        return _decode_json_response(self._decode_classification, result_text)
+    
+    def _decode_classification(self, result_text: str) -> Dict[str, Any]:
+        """Decode a JSON classification object, filling in missing fields."""
+        if _classification_decoder is not None:
+            try:
+                return msgspec.structs.asdict(_classification_decoder.decode(result_text))
+            except msgspec.ValidationError:
+                # Valid JSON with unexpected field types: keep the values as the model sent them
+                pass
+        
+        return self._ensure_fields(json.loads(result_text))
+    
+    @staticmethod
+    def _ensure_fields(result: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in any required field missing from a model response."""
+        required_fields = ["dependencia", "confianza", "motivo", "palabras_clave"]
+        for field in required_fields:
+            if field not in result:
+                result[field] = "N/A" if field != "palabras_clave" else []
+        return result
+    
+    @staticmethod
+    def _parse_index(value) -> Optional[int]:
+        """Petition number of a packed response item; models sometimes send "2", "[2]" or 2.0 instead of 2."""
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return int(value) if value.is_integer() else None
+        if isinstance(value, str):
+            value = value.strip().strip("[]").strip()
+            return int(value) if value.isdigit() else None
+        return None
+    
+    @staticmethod
+    def _error_result(motivo: str) -> Dict[str, Any]:
+        """Build the classification returned when a petition cannot be classified."""
+        return {
+            "dependencia": "Error",
+            "confianza": "0%",
+            "motivo": motivo,
+            "palabras_clave": []
+        }
+    
+    def _truncate_to_budget(self, text: str) -> str:
+        """
+        Keep a petition within MAX_PETITION_TOKENS by dropping the middle.
+        
+        The head (addressee, subject, request) and tail (closing, signature) carry
+        the classification signal, so no extra API calls are spent summarizing.
+        """
+        encoding = self._encoding
+        if encoding is None:
+            # Rough estimate: 1 token ≈ 4 characters
+            if len(text) // 4 <= self.MAX_PETITION_TOKENS:
+                return text
+            logger.info("Text too large (~%d tokens). Truncating middle...", len(text) // 4)
+            head, tail = text[:self.TRUNCATE_HEAD_TOKENS * 4], text[-self.TRUNCATE_TAIL_TOKENS * 4:]
+        else:
+            tokens = encoding.encode(text, disallowed_special=())
+            if len(tokens) <= self.MAX_PETITION_TOKENS:
+                return text
+            logger.info("Text too large (%d tokens). Truncating middle...", len(tokens))
+            head = encoding.decode(tokens[:self.TRUNCATE_HEAD_TOKENS])
+            tail = encoding.decode(tokens[-self.TRUNCATE_TAIL_TOKENS:])
+        return f"{head}\n\n[Texto truncado por límite de tokens]\n\n{tail}"
@@ -3,95 +3,272 @@ PDF text extraction module.
 Handles both text-based PDFs (using pdfplumber) and scanned PDFs (using pytesseract + pdf2image).
 """
 
-import pdfplumber
-import pytesseract
-from pdf2image import convert_from_path
-from PIL import Image
 import io
+import re
 import tempfile
+import shutil
 import os
-from typing import Optional
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, BinaryIO, Union
+
+# pdfplumber, pytesseract and pdf2image are imported where they are used, so
+# importing this module (e.g. at app startup) stays cheap
+
+logger = logging.getLogger(__name__)
+
+# PDFs with fewer pages are extracted sequentially (process startup would dominate)
+PARALLEL_MIN_PAGES = 8
+# OCR costs about a second per page, so scanned PDFs are split across processes much sooner
+OCR_PARALLEL_MIN_PAGES = 2
+# Classification only needs readable words, not archival quality
+OCR_DPI = 200
+# LSTM engine, page treated as a single block of text (skips layout analysis)
+OCR_CONFIG = "--oem 1 --psm 6"
+# Fewer non-whitespace characters than this from pdfplumber means a scanned PDF
+OCR_MIN_CHARS = 200
+# Pages checked for a text layer before running pdfplumber's layout analysis
+SCAN_CHECK_PAGES = 2
+
+_WHITESPACE = re.compile(r"\s+")
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the shared process pool used for parallel page extraction."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn avoids forking a process that is running threads (event loop, thread pool)
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+    return _process_pool
+
+
+def _reset_process_pool():
+    """Shut down and discard the shared process pool."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+# A PDF given as a file path, its content, or a seekable binary stream (e.g. a spooled upload)
+PDFSource = Union[str, bytes, BinaryIO]
+
+
+def _open_pdf(source: PDFSource, **kwargs):
+    """Open a PDF with pdfplumber from a file path, its content in memory, or a stream."""
+    import pdfplumber
+    if isinstance(source, str):
+        return pdfplumber.open(source, **kwargs)
+    if isinstance(source, bytes):
+        return pdfplumber.open(io.BytesIO(source), **kwargs)
+    # pdfplumber leaves caller-owned streams open
+    source.seek(0)
+    return pdfplumber.open(source, **kwargs)
+
+
+@contextmanager
+def _path_or_bytes(source: PDFSource):
+    """
+    Yield the PDF as a path or bytes, for worker processes and pdf2image.
+    
+    Streams are copied to a temporary file in chunks (deleted afterwards), so
+    memory use does not grow with the size of the PDF.
+    """
+    if isinstance(source, (str, bytes)):
+        yield source
+        return
+    
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        shutil.copyfileobj(source, tmp_file)
+        tmp_path = tmp_file.name
+    try:
+        yield tmp_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _extract_page_range(source: Union[str, bytes], start: int, end: int) -> str:
+    """Extract text from pages [start, end) of a PDF (runs in a worker process)."""
+    with _open_pdf(source, pages=list(range(start + 1, end + 1))) as pdf:
+        return _pages_text(pdf.pages)
+
+
+def _pages_text(pages) -> str:
+    """Join the text of pdfplumber pages, dropping each page's parsed objects once read."""
+    parts = []
+    for page in pages:
+        page_text = page.extract_text()
+        if page_text:
+            parts.append(page_text + "\n")
+        page.flush_cache()
+    return "".join(parts)
+
+
+def _ocr_page_range(source: Union[str, bytes], start: int, end: int, thread_count: int = 1) -> str:
+    """Render pages [start, end) of a PDF and OCR them (runs in a worker process)."""
+    import pytesseract
+    from pdf2image import convert_from_path, convert_from_bytes
+    
+    convert = convert_from_path if isinstance(source, str) else convert_from_bytes
+    images = convert(
+        source, dpi=OCR_DPI, first_page=start + 1, last_page=end, thread_count=thread_count
+    )
+    ocr = pytesseract.image_to_string
+    return "".join([ocr(image, lang='spa', config=OCR_CONFIG) + "\n" for image in images])
 
 
 class PDFExtractor:
     """Extracts text from PDF files, handling both digital and scanned documents."""
     
-    def __init__(self):
+    def __init__(self, workers: Optional[int] = None):
+        """
+        Initialize the extractor.
+        
+        Args:
+            workers: Processes used to extract large PDFs in parallel
+                     (default: PDF_EXTRACTION_WORKERS env var or CPU count; 1 disables)
+        """
         # You can set custom tesseract path if needed
         # pytesseract.pytesseract.tesseract_cmd = r'/usr/local/bin/tesseract'
-        pass
+        self.workers = workers or int(os.getenv("PDF_EXTRACTION_WORKERS", os.cpu_count() or 1))
+        # Set after the first successful tesseract probe, so later OCR calls skip the subprocess
+        self._tesseract_ok = False
     
-    def extract_text(self, pdf_path: str) -> str:
+    def extract_text(self, pdf_path: PDFSource) -> str:
         """
         Extract text from PDF file.
         First tries pdfplumber (fast, for text-based PDFs).
         If minimal text is found, falls back to OCR (for scanned PDFs).
         
         Args:
-            pdf_path: Path to the PDF file
+            pdf_path: Path to the PDF file, the PDF content as bytes, or a seekable binary stream
             
         Returns:
             Extracted text as string
         """
-        # Try text-based extraction first
-        text = self._extract_with_pdfplumber(pdf_path)
+        # Try text-based extraction first (skipped when the first pages have no text layer)
+        text = self._extract_with_pdfplumber(pdf_path, check_scanned=True)
+        looks_scanned = text is None
+        if looks_scanned:
+            text = ""
         
         # If we got very little text, it's probably a scanned PDF
-        if len(text.strip()) < 100:
-            print(f"Limited text found ({len(text)} chars). Attempting OCR...")
+        if len(_WHITESPACE.sub("", text)) < OCR_MIN_CHARS:
+            logger.info("Limited text found (%d chars). Attempting OCR...", len(text))
+            ocr_error = None
             try:
                 ocr_text = self._extract_with_ocr(pdf_path)
                 if len(ocr_text) > len(text):
                     text = ocr_text
             except Exception as e:
-                print(f"OCR failed: {e}")
+                logger.warning("OCR failed: %s", e)
+                ocr_error = e
+            
+            # Mixed PDFs (e.g. a scanned cover page before digital text): OCR was tried
+            # first, but the text layer of the remaining pages is still used
+            if looks_scanned and len(_WHITESPACE.sub("", text)) < OCR_MIN_CHARS:
+                plumber_text = self._extract_with_pdfplumber(pdf_path)
+                if len(plumber_text) > len(text):
+                    text = plumber_text
+            
+            if ocr_error is not None:
                 # If OCR fails, return what we have and add a note
                 if len(text.strip()) == 0:
                     text = "OCR no disponible. Este PDF parece ser una imagen escaneada. Por favor, use un PDF con texto extraíble o contacte al administrador para configurar OCR."
                 else:
-                    text += f"\n\n[Nota: OCR no disponible - {str(e)}]"
+                    text += f"\n\n[Nota: OCR no disponible - {str(ocr_error)}]"
         
         return text.strip()
     
-    def _extract_with_pdfplumber(self, pdf_path: str) -> str:
-        """Extract text using pdfplumber (for text-based PDFs)."""
+    def _extract_with_pdfplumber(self, pdf_path: PDFSource, check_scanned: bool = False) -> Optional[str]:
+        """
+        Extract text using pdfplumber (for text-based PDFs).
+        
+        Args:
+            pdf_path: Path to the PDF file, the PDF content as bytes, or a seekable binary stream
+            check_scanned: Return None without extracting when the first pages have no text layer
+        """
         text = ""
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-            print(f"Extracted {len(text)} characters using pdfplumber")
+            with _open_pdf(pdf_path) as pdf:
+                page_count = len(pdf.pages)
+                # No characters on the first pages: probably a scan, so OCR is tried first
+                if check_scanned and not any(page.chars for page in pdf.pages[:SCAN_CHECK_PAGES]):
+                    logger.info("No text layer on the first %d page(s); trying OCR first", min(page_count, SCAN_CHECK_PAGES))
+                    return None
+                if self.workers > 1 and page_count >= PARALLEL_MIN_PAGES:
+                    with _path_or_bytes(pdf_path) as worker_source:
+                        text = self._extract_pages_parallel(worker_source, page_count)
+                if not text:
+                    text = _pages_text(pdf.pages)
+            logger.info("Extracted %d characters using pdfplumber", len(text))
         except Exception as e:
-            print(f"Error extracting with pdfplumber: {e}")
+            logger.error("Error extracting with pdfplumber: %s", e)
         
         return text
     
-    def _extract_with_ocr(self, pdf_path: str) -> str:
+    def _extract_pages_parallel(self, pdf_path: Union[str, bytes], page_count: int, extract_range=_extract_page_range) -> str:
+        """Split the page range into contiguous chunks and extract them in worker processes."""
+        workers = min(self.workers, page_count)
+        chunk_size = -(-page_count // workers)  # ceiling division
+        ranges = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+        
+        logger.info("Extracting %d pages in %d parallel chunks...", page_count, len(ranges))
+        try:
+            pool = _get_process_pool(self.workers)
+            futures = [pool.submit(extract_range, pdf_path, start, end) for start, end in ranges]
+            
+            # Results are joined in page order
+            return "".join(future.result() for future in futures)
+        except Exception as e:
+            # A broken pool is discarded so the next call starts a fresh one
+            logger.warning("Parallel extraction failed, falling back to sequential: %s", e)
+            _reset_process_pool()
+            return ""
+    
+    def _extract_with_ocr(self, pdf_path: PDFSource) -> str:
         """Extract text using OCR (for scanned PDFs)."""
+        import pytesseract
+        from pdf2image import pdfinfo_from_path, pdfinfo_from_bytes
+        
         text = ""
         try:
-            # Check if tesseract is available
-            try:
-                pytesseract.get_tesseract_version()
-            except Exception:
-                raise Exception("tesseract is not installed or it's not in your PATH. See README file for more information.")
+            # Check if tesseract is available (probed once; a failed probe is retried next time)
+            if not self._tesseract_ok:
+                try:
+                    pytesseract.get_tesseract_version()
+                except Exception:
+                    raise Exception("tesseract is not installed or it's not in your PATH. See README file for more information.")
+                self._tesseract_ok = True
             
-            # Convert PDF to images
-            images = convert_from_path(pdf_path, dpi=300)
+            # pdf2image (poppler) needs a file path or the PDF bytes
+            with _path_or_bytes(pdf_path) as source:
+                pdfinfo = pdfinfo_from_path if isinstance(source, str) else pdfinfo_from_bytes
+                page_count = pdfinfo(source)["Pages"]
+                logger.info("Processing %d pages with OCR...", page_count)
+                
+                # Pages are independent and CPU-bound: render and OCR them in worker processes
+                if self.workers > 1 and page_count >= OCR_PARALLEL_MIN_PAGES:
+                    text = self._extract_pages_parallel(source, page_count, extract_range=_ocr_page_range)
+                if not text:
+                    text = _ocr_page_range(source, 0, page_count, thread_count=self.workers)
             
-            print(f"Processing {len(images)} pages with OCR...")
-            
-            # Perform OCR on each page
-            for i, image in enumerate(images):
-                print(f"OCR processing page {i+1}/{len(images)}...")
-                page_text = pytesseract.image_to_string(image, lang='spa')
-                text += page_text + "\n"
-            
-            print(f"Extracted {len(text)} characters using OCR")
+            logger.info("Extracted %d characters using OCR", len(text))
         except Exception as e:
-            print(f"Error extracting with OCR: {e}")
+            logger.error("Error extracting with OCR: %s", e)
             # Provide more helpful error message
             if "tesseract" in str(e).lower():
                 raise Exception(f"OCR extraction failed: {str(e)}. Make sure Tesseract and Poppler are installed.")
@@ -104,23 +281,27 @@ class PDFExtractor:
         """
         Extract text from PDF bytes (useful for uploaded files).
         
+        The PDF is read from memory, without a round trip through a temporary file.
+        
         Args:
             pdf_bytes: PDF file content as bytes
             
         Returns:
             Extracted text as string
         """
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(pdf_bytes)
-            tmp_path = tmp_file.name
+        return self.extract_text(pdf_bytes)
+    
+    def extract_from_stream(self, pdf_stream: BinaryIO) -> str:
+        """
+        Extract text from a seekable binary file-like object (e.g. a spooled upload).
         
-        try:
-            text = self.extract_text(tmp_path)
-        finally:
-            # Clean up temporary file
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
+        pdfplumber reads the stream directly; it is only copied to a temporary
+        file (in chunks) when worker processes or OCR need a file path.
         
-        return text
-
+        Args:
+            pdf_stream: Readable, seekable binary stream containing the PDF
+            
+        Returns:
+            Extracted text as string
+        """
+        return self.extract_text(pdf_stream)
@@ -2,15 +2,140 @@
 PDF generator utility for creating PDFs from Excel search results.
 """
 
+import os
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from io import BytesIO
-from typing import Dict, Any, List
+from typing import Dict, Any, List, BinaryIO, Optional, Tuple
 from pathlib import Path
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, Spacer, Image, PageBreak
 from reportlab.lib.enums import TA_LEFT
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+# Characters with a meaning in ReportLab's Paragraph markup
+_NEEDS_ESCAPE = re.compile(r'[&<>"\']')
+
+# Contracts sheet columns used for each result's heading and ID line
+NAME_KEY = 'CONTRATISTA : NOMBRE COMPLETO O RAZON SOCIAL'
+ID_KEY = 'CONTRATISTA: NÚMERO DE IDENTIFICACIÓN'
+CONTRACT_KEY = 'No. \\nCto'
+
+# Cell values treated as empty (missing data in the contracts sheet)
+EMPTY_VALUES = frozenset(('', 'nan', 'n/a', 'na', 'NaN', 'NAN', 'N/A', 'NA'))
+
+# Page margins and the width left for field text inside the document frame
+# (SimpleDocTemplate's frame pads 6pt on each side)
+PAGE_MARGIN = 72
+FRAME_PADDING = 6
+TEXT_WIDTH = A4[0] - 2 * PAGE_MARGIN - 2 * FRAME_PADDING
+
+
+@lru_cache(maxsize=512)
+def _format_key(key: str) -> str:
+    """Label text for a column name (underscores to spaces, title case); columns repeat for every result."""
+    return key.replace('_', ' ').title()
+
+
+LOGO_PATH = Path(__file__).parent.parent / "static" / "images" / "icetex.png"
+
+
+def _build_styles() -> Dict[str, ParagraphStyle]:
+    """Create the paragraph styles shared by every generated PDF."""
+    # Define styles - using Helvetica (similar to Satoshi) since it's built-in to ReportLab
+    # For true Satoshi font, you would need to download TTF files and register them
+    styles = getSampleStyleSheet()
+
+    # Title style - left aligned
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=20,
+        textColor=colors.HexColor('#111827'),
+        spaceAfter=20,
+        alignment=TA_LEFT,
+        fontName='Helvetica-Bold'
+    )
+
+    # Header style - left aligned
+    header_style = ParagraphStyle(
+        'CustomHeader',
+        parent=styles['Heading2'],
+        fontSize=16,
+        textColor=colors.HexColor('#111827'),
+        spaceAfter=10,
+        spaceBefore=20,
+        alignment=TA_LEFT,
+        fontName='Helvetica-Bold'
+    )
+
+    # Label style - left aligned, bold
+    label_style = ParagraphStyle(
+        'CustomLabel',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#6b7280'),
+        spaceAfter=4,
+        spaceBefore=0,
+        alignment=TA_LEFT,
+        fontName='Helvetica-Bold'
+    )
+
+    # Value style - left aligned, regular weight
+    value_style = ParagraphStyle(
+        'CustomValue',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#111827'),
+        spaceAfter=16,
+        leftIndent=0,
+        alignment=TA_LEFT,
+        fontName='Helvetica'
+    )
+
+    query_style = ParagraphStyle(
+        'QueryStyle',
+        parent=styles['Normal'],
+        fontSize=11,
+        alignment=TA_LEFT,
+        fontName='Helvetica',
+        textColor=colors.HexColor('#111827'),
+        spaceAfter=6
+    )
+
+    id_style = ParagraphStyle(
+        'IdStyle',
+        parent=styles['Normal'],
+        fontSize=11,
+        alignment=TA_LEFT,
+        fontName='Helvetica',
+        textColor=colors.HexColor('#111827'),
+        spaceAfter=12
+    )
+
+    return {
+        'title': title_style,
+        'header': header_style,
+        'label': label_style,
+        'value': value_style,
+        'query': query_style,
+        'id': id_style,
+    }
+
+
+# Built once at import; ParagraphStyle objects are only read while building documents
+_STYLES = _build_styles()
+
+
+def _generate_pdf_bytes(job: Tuple[List[Dict[str, Any]], str]) -> bytes:
+    """Render one (results, query) export to PDF bytes (runs in a worker process)."""
+    results, query = job
+    return PDFGenerator().generate_result_pdf(results, query).getvalue()
 
 
 class PDFGenerator:
@@ -18,34 +143,42 @@ class PDFGenerator:
     
     def __init__(self):
         """Initialize the PDF generator."""
-        pass
+        self._styles = _STYLES
     
-    def generate_result_pdf(self, results: List[Dict[str, Any]], query: str) -> BytesIO:
+    def generate_result_pdf(
+        self,
+        results: List[Dict[str, Any]],
+        query: str,
+        output: Optional[BinaryIO] = None
+    ) -> BinaryIO:
         """
         Generate a PDF document from search results.
         
         Args:
             results: List of dictionaries containing search result data
             query: The search query that generated these results
+            output: Writable binary stream to write the PDF to (default: a new BytesIO)
             
         Returns:
-            BytesIO buffer containing the PDF data
+            The stream containing the PDF data, positioned at the start when seekable
         """
-        buffer = BytesIO()
+        buffer = output if output is not None else BytesIO()
+        
+        styles = self._styles
         
         # Create PDF document (using A4 size which is similar to letter)
         doc = SimpleDocTemplate(buffer, pagesize=A4,
-                                rightMargin=72, leftMargin=72,
-                                topMargin=72, bottomMargin=72)
+                                rightMargin=PAGE_MARGIN, leftMargin=PAGE_MARGIN,
+                                topMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN)
         
         # Container for the 'Flowable' objects
         story = []
         
         # Add ICETEX logo at the top - left aligned
-        logo_path = Path(__file__).parent.parent / "static" / "images" / "icetex.png"
-        if logo_path.exists():
+        # Flowables are consumed by doc.build(), so the Image is created per document
+        if LOGO_PATH.exists():
             try:
-                logo = Image(str(logo_path), width=2*inch, height=0.6*inch)
+                logo = Image(str(LOGO_PATH), width=2*inch, height=0.6*inch)
                 logo.hAlign = 'LEFT'
                 story.append(logo)
                 story.append(Spacer(1, 0.3*inch))
@@ -53,132 +186,61 @@ class PDFGenerator:
                 # If image fails to load, continue without logo
                 pass
         
-        # Define styles - using Helvetica (similar to Satoshi) since it's built-in to ReportLab
-        # For true Satoshi font, you would need to download TTF files and register them
-        styles = getSampleStyleSheet()
-        
-        # Title style - left aligned
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=20,
-            textColor=colors.HexColor('#111827'),
-            spaceAfter=20,
-            alignment=TA_LEFT,
-            fontName='Helvetica-Bold'
-        )
-        
-        # Header style - left aligned
-        header_style = ParagraphStyle(
-            'CustomHeader',
-            parent=styles['Heading2'],
-            fontSize=16,
-            textColor=colors.HexColor('#111827'),
-            spaceAfter=10,
-            spaceBefore=20,
-            alignment=TA_LEFT,
-            fontName='Helvetica-Bold'
-        )
-        
-        # Label style - left aligned, bold
-        label_style = ParagraphStyle(
-            'CustomLabel',
-            parent=styles['Normal'],
-            fontSize=11,
-            textColor=colors.HexColor('#6b7280'),
-            spaceAfter=4,
-            spaceBefore=0,
-            alignment=TA_LEFT,
-            fontName='Helvetica-Bold'
-        )
-        
-        # Value style - left aligned, regular weight
-        value_style = ParagraphStyle(
-            'CustomValue',
-            parent=styles['Normal'],
-            fontSize=11,
-            textColor=colors.HexColor('#111827'),
-            spaceAfter=16,
-            leftIndent=0,
-            alignment=TA_LEFT,
-            fontName='Helvetica'
-        )
-        
         # Add title - left aligned
-        title = Paragraph("ICETEX - Información de Contratista", title_style)
+        title = Paragraph("ICETEX - Información de Contratista", styles['title'])
         story.append(title)
         story.append(Spacer(1, 0.25*inch))
         
         # Add search query info - left aligned
-        query_style = ParagraphStyle(
-            'QueryStyle',
-            parent=styles['Normal'],
-            fontSize=11,
-            alignment=TA_LEFT,
-            fontName='Helvetica',
-            textColor=colors.HexColor('#111827'),
-            spaceAfter=6
-        )
-        query_text = Paragraph(f"<b>Búsqueda realizada:</b> {self._escape_html(query)}", query_style)
+        query_text = Paragraph(f"<b>Búsqueda realizada:</b> {self._escape_html(query)}", styles['query'])
         story.append(query_text)
         
-        results_count = Paragraph(f"<b>Resultados encontrados:</b> {len(results)}", query_style)
+        results_count = Paragraph(f"<b>Resultados encontrados:</b> {len(results)}", styles['query'])
         story.append(results_count)
         story.append(Spacer(1, 0.3*inch))
         
         # Process each result
         for idx, result in enumerate(results, 1):
             # Add result header
-            main_title = result.get('CONTRATISTA : NOMBRE COMPLETO O RAZON SOCIAL', 
-                                   result.get('No. \\nCto', f'Resultado {idx}'))
+            # Same fallback order as before (a present but empty name is kept), with the
+            # default only built when neither column exists
+            if NAME_KEY in result:
+                main_title = result[NAME_KEY]
+            elif CONTRACT_KEY in result:
+                main_title = result[CONTRACT_KEY]
+            else:
+                main_title = f'Resultado {idx}'
             
-            header = Paragraph(f"Resultado {idx}: {self._escape_html(str(main_title))}", header_style)
+            header = Paragraph(f"Resultado {idx}: {self._escape_html(str(main_title))}", styles['header'])
             story.append(header)
             
             # Get ID if available
-            subtitle = result.get('CONTRATISTA: NÚMERO DE IDENTIFICACIÓN', 
-                                result.get('No. \\nCto', ''))
+            subtitle = result[ID_KEY] if ID_KEY in result else result.get(CONTRACT_KEY, '')
             if subtitle:
-                id_style = ParagraphStyle(
-                    'IdStyle',
-                    parent=styles['Normal'],
-                    fontSize=11,
-                    alignment=TA_LEFT,
-                    fontName='Helvetica',
-                    textColor=colors.HexColor('#111827'),
-                    spaceAfter=12
-                )
-                id_text = Paragraph(f"<b>ID:</b> {self._escape_html(str(subtitle))}", id_style)
+                id_text = Paragraph(f"<b>ID:</b> {self._escape_html(str(subtitle))}", styles['id'])
                 story.append(id_text)
             
             # Add spacing before fields
             story.append(Spacer(1, 0.15*inch))
             
-            # Get all non-empty fields
-            fields = []
+            # Add every non-empty field as a label (bold, gray) and value (regular, black),
+            # in organized list format (no table); long values wrap automatically
+            label_style, value_style = styles['label'], styles['value']
             for key, value in result.items():
-                # Skip empty values
-                if value is None or str(value).strip().lower() in ['', 'nan', 'n/a', 'na']:
+                # Skip empty values (lowercasing only when the common spellings miss)
+                if value is None:
+                    continue
+                formatted_value = (value if isinstance(value, str) else str(value)).strip()
+                if (not formatted_value or formatted_value in EMPTY_VALUES
+                        or formatted_value.lower() in EMPTY_VALUES):
                     continue
                 
-                # Format key (replace underscores, capitalize)
-                formatted_key = str(key).replace('_', ' ').title()
-                
-                # Format value
-                formatted_value = str(value).strip()
-                
-                fields.append((formatted_key, formatted_value))
-            
-            # Display fields in organized list format (no table)
-            if fields:
-                for key, value in fields:
-                    # Add label (bold, gray)
-                    label = Paragraph(f"<b>{self._escape_html(key)}</b>", label_style)
-                    story.append(label)
-                    
-                    # Add value (regular, black) - will wrap automatically
-                    value_para = Paragraph(self._escape_html(str(value)), value_style)
-                    story.append(value_para)
+                # Flowables keep layout state (e.g. _postponed) once placed, so each field
+                # gets its own; only the formatted label text is shared via _format_key
+                story.extend((
+                    self._field_text(_format_key(str(key)), label_style),
+                    self._field_text(formatted_value, value_style),
+                ))
             
             # Add page break between results (except for the last one)
             if idx < len(results):
@@ -188,17 +250,56 @@ class PDFGenerator:
         doc.build(story)
         
         # Reset buffer position
-        buffer.seek(0)
+        if buffer.seekable():
+            buffer.seek(0)
         return buffer
     
+    def generate_many(
+        self,
+        jobs: List[Tuple[List[Dict[str, Any]], str]],
+        workers: Optional[int] = None
+    ) -> List[bytes]:
+        """
+        Generate several PDFs, one per (results, query) job, in parallel processes.
+        
+        ReportLab layout is pure Python, so documents only render concurrently in
+        separate processes.
+        
+        Args:
+            jobs: (results, query) pairs, as passed to generate_result_pdf()
+            workers: Maximum worker processes (default: CPU count; 1 renders in this process)
+            
+        Returns:
+            PDF bytes for each job, in input order
+        """
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        if workers <= 1:
+            return [self.generate_result_pdf(results, query).getvalue() for results, query in jobs]
+        
+        # spawn avoids forking a process that is running threads (event loop, thread pool)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return list(pool.map(_generate_pdf_bytes, jobs))
+    
+    def _field_text(self, text: str, style: ParagraphStyle):
+        """Flowable for a field label or value: plain text when it fits on one line, else a wrapping Paragraph."""
+        # Preformatted never wraps, so only single lines measured to fit the frame skip Paragraph
+        if ('\n' not in text
+                and stringWidth(text, style.fontName, style.fontSize) <= TEXT_WIDTH - style.leftIndent):
+            return Preformatted(text, style)
+        return Paragraph(self._escape_html(text), style)
+    
     def _escape_html(self, text: str) -> str:
         """Escape HTML special characters for safe display in PDF."""
         if not text:
             return ""
         text = str(text)
-        text = text.replace('&', '&amp;')
-        text = text.replace('<', '&lt;')
-        text = text.replace('>', '&gt;')
-        text = text.replace('"', '&quot;')
-        text = text.replace("'", '&#39;')
-        return text
+        # Most fields (names, IDs, dates) contain nothing to escape: return them without copying
+        if _NEEDS_ESCAPE.search(text) is None:
+            return text
+        # Chained str.replace beats str.translate here: translate with multi-character
+        # replacements takes a slow per-character path (4-18x slower on field texts)
+        return (text.replace('&', '&amp;')
+                    .replace('<', '&lt;')
+                    .replace('>', '&gt;')
+                    .replace('"', '&quot;')
+                    .replace("'", '&#39;'))
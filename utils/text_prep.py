@@ -0,0 +1,93 @@
+"""
+Text preparation for petition classification.
+Condenses long petitions before they are sent to OpenAI, keeping the parts
+that decide the dependency (header, closing, keyword-bearing sentences).
+"""
+
+import re
+import unicodedata
+
+# Keyword stems from the classifier's decision rules (accent-free, lowercase);
+# prefixes so plurals and inflections also match (e.g. "condona" -> "condonación")
+DECISION_KEYWORDS = (
+    # Fondos en Administración
+    "fondo", "convenio", "condona", "beca", "credito condonable",
+    # Jurídica
+    "demanda", "sancion", "resolucion", "fallo", "normatividad", "derecho", "apelacion", "abogad",
+    "tutela", "recurso",
+    # Riesgos / Control Interno
+    "riesgo", "cumplimiento", "control interno", "auditor", "transparencia",
+    # Planeación
+    "planeacion", "estrategi", "indicador", "metas institucionales",
+    # Operaciones y Tecnología
+    "tecnolog", "plataforma", "sistema", "error", "mantenimiento",
+    # Comunicaciones
+    "comunicacion", "prensa", "medios", "campana",
+    # Crédito y Cobranza
+    "cobro", "mora", "pago", "deuda", "cartera", "credito",
+    # Financiera
+    "presupuest", "finanz", "financier", "tesoreria", "contabilidad",
+    # Relaciones Internacionales
+    "internacional", "exterior", "cooperacion",
+    # Comercial y Mercadeo
+    "comercial", "mercadeo", "usuario", "aliado", "atencion al cliente",
+    # Secretaría General
+    "personal", "contratacion", "contrato", "archivo", "secretaria",
+    # What is being requested
+    "solicit", "peticion", "queja", "reclamo",
+)
+
+KEYWORD_PATTERN = re.compile(r"\b(?:" + "|".join(re.escape(k) for k in DECISION_KEYWORDS) + r")")
+
+# Sentence boundaries: end punctuation followed by whitespace, or blank lines
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?;:])\s+|\n\s*\n")
+
+OMISSION_MARKER = "[...]"
+
+
+def _fold(text: str) -> str:
+    """Lowercase and strip accents so keywords match regardless of diacritics."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def condense(text: str, max_chars: int = 8000, head_chars: int = 1500, tail_chars: int = 500) -> str:
+    """
+    Shrink a long petition to at most about max_chars characters.
+
+    Keeps the first head_chars (addressee, subject, request) and last tail_chars
+    (closing, signature), plus as many sentences from the middle as fit that
+    contain a decision keyword, in their original order. Texts already within
+    max_chars are returned unchanged.
+
+    Args:
+        text: Extracted petition text
+        max_chars: Target maximum length
+        head_chars: Characters always kept from the start
+        tail_chars: Characters always kept from the end
+
+    Returns:
+        Condensed text
+    """
+    if len(text) <= max_chars:
+        return text
+
+    head = text[:head_chars]
+    tail = text[-tail_chars:] if tail_chars else ""
+    middle = text[head_chars:len(text) - tail_chars]
+
+    budget = max_chars - len(head) - len(tail) - 2 * (len(OMISSION_MARKER) + 2)
+    selected = []
+    for sentence in SENTENCE_SPLIT.split(middle):
+        sentence = sentence.strip()
+        if not sentence or len(sentence) + 1 > budget:
+            continue
+        if KEYWORD_PATTERN.search(_fold(sentence)):
+            selected.append(sentence)
+            budget -= len(sentence) + 1
+
+    parts = [head, OMISSION_MARKER]
+    if selected:
+        parts.extend(["\n".join(selected), OMISSION_MARKER])
+    parts.append(tail)
+    return "\n".join(parts)